@@ -2,9 +2,12 @@
 #    Serial setup for ASI stage
 # ===============================================================================
 
+import time
 import serial
+import threading
 
 from serial import SerialException
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 class SerialPort:
@@ -23,8 +26,13 @@ class SerialPort:
         self.serial_port.timeout = 1
         self.report = report
 
+        # serializes command/reply transactions across threads
+        self.lock = threading.RLock()
+
         # set size of rx/tx buffers before opening serial port
-        self.serial_port.set_buffer_size(rx_size=12800, tx_size=12800)
+        # (only supported on Windows, e.g. not for emulator ptys)
+        if hasattr(self.serial_port, "set_buffer_size"):
+            self.serial_port.set_buffer_size(rx_size=12800, tx_size=12800)
 
         # open serial port
         try:
@@ -62,11 +70,134 @@ class SerialPort:
                 print(f"<-- {response}")
         return response
 
+    def query(self, command: str, print_to_console: bool = True) -> str:
+        """Send a command and return its reply as one transaction
+
+        Holding the port lock keeps replies matched to their commands when
+        the port is shared between threads
+        """
+        with self.lock:
+            self.send_command(command)
+            return self.read_response(print_to_console)
+
     def close(self):
         if self.serial_port.is_open:
             self.serial_port.close()
 
 
+class ASIError(Exception):
+    """Error reply from the MS2000 controller"""
+
+    # error codes documented in the MS2000 manual
+    MESSAGES = {
+        1: "Unknown command",
+        2: "Unrecognized axis parameter",
+        3: "Missing parameters",
+        4: "Parameter out of range",
+        5: "Operation failed",
+        6: "Undefined error",
+        21: "Serial command halted by the HALT command",
+    }
+
+    def __init__(self, command: str, response: str):
+        self.command = command
+        self.response = response
+        self.code = parse_error(response)
+
+        if not response:
+            message = "No reply before timeout"
+        elif self.code in self.MESSAGES:
+            message = self.MESSAGES[self.code]
+        elif 7 <= self.code <= 20:
+            message = "Filterwheel error"
+        else:
+            message = "Reserved error code"
+
+        super().__init__(f"{command!r} returned {response!r} ({message})")
+
+
+def parse_error(response: str) -> int:
+    """Return the error code of a reply, or 0 if the reply is not an error"""
+    if response.startswith(":N"):
+        try:
+            return abs(int(response[2:].strip()))
+        except ValueError:
+            return 6
+    return 0
+
+
+class CommandBatch:
+    """Queue serial commands and send them in a single write
+
+    Replies are read back in order once all commands are written, so a
+    sequence of N commands costs one round-trip instead of N. Use as a
+    context manager, the batch is sent when the block exits:
+
+        with stage.batch() as batch:
+            batch.add("TTL X=1")
+            batch.add("SN")
+    """
+
+    def __init__(
+        self, port: SerialPort, raise_errors: bool = True, print_to_console: bool = True
+    ):
+        self.port = port
+        self.raise_errors = raise_errors
+        self.print_to_console = print_to_console
+        self.commands = []
+        self.responses = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def add(self, command: str) -> int:
+        """Queue a command and return the index of its reply"""
+        self.commands.append(command)
+        return len(self.commands) - 1
+
+    def send(self) -> list:
+        """Write all queued commands and match the replies in order
+
+        Raises ASIError for the first error reply once every reply has been
+        read, so the serial buffers stay in sync. A missing reply (timeout)
+        is an error too: reading stops there, the replies still missing are
+        returned empty and any late ones are flushed, as they can no longer
+        be matched to their commands
+        """
+        if not self.commands:
+            return self.responses
+
+        with self.port.lock:
+            # good practice to reset buffers before each transmission
+            self.port.serial_port.reset_input_buffer()
+            self.port.serial_port.reset_output_buffer()
+
+            payload = "".join(command + "\r" for command in self.commands)
+            self.port.serial_port.write(payload.encode())
+
+            self.responses = []
+            for _ in self.commands:
+                response = self.port.read_response(self.print_to_console)
+                if not response:
+                    break
+                self.responses.append(response)
+
+            if len(self.responses) < len(self.commands):
+                self.port.serial_port.reset_input_buffer()
+                self.responses += [""] * (len(self.commands) - len(self.responses))
+
+        if self.raise_errors:
+            for command, response in zip(self.commands, self.responses):
+                if not response or parse_error(response):
+                    raise ASIError(command, response)
+
+        return self.responses
+
+
 class MS2000(SerialPort):
     """Serial connection to MS2000 controller
 
@@ -85,9 +216,15 @@ class MS2000(SerialPort):
     # valid baudrates
     BAUDRATES = [9600, 19200, 28800, 115200]
 
+    # ring buffer capacity
+    BUFFER_SIZE = 50
+
     def __init__(self, port: str, baudrate: int = 115200):
         super().__init__(port, baudrate)
 
+        # runs background waits, created on first use
+        self._executor = None
+
         # validate user baudrate
         if baudrate not in self.BAUDRATES:
             raise ValueError(
@@ -96,106 +233,94 @@ class MS2000(SerialPort):
 
     def moverel(self, x: int = 0, y: int = 0, z: int = 0, f: int = 0):
         """Relative stage translation"""
-        self.send_command(f"R X={x} Y={y} Z={z} F={f}")
-        self.read_response()
+        self.query(f"R X={x} Y={y} Z={z} F={f}")
 
     def moverel_axis(self, axis: str, dist: int):
         "Relative translation for specific axis"
-        self.send_command(f"R {axis}={dist}")
-        self.read_response()
+        self.query(f"R {axis}={dist}")
 
     def move(self, x: int = 0, y: int = 0, z: int = 0, f: int = 0):
         "Absolute stage translation"
-        self.send_command(f"M X={x} Y={y} Z={z} F={f}")
-        self.read_response()
+        self.query(f"M X={x} Y={y} Z={z} F={f}")
 
     def move_axis(self, axis: str, dist: int):
         "Absolute translation for specific axis"
-        self.send_command(f"M {axis}={dist}")
-        self.read_response()
+        self.query(f"M {axis}={dist}")
 
     def set_speed(self, x: int = None, y: int = None, z: int = None):
         """Set motor velocity in mm/s"""
         if x and y and z:
-            self.send_command(f"S X={x} Y={y} Z={z}")
+            self.query(f"S X={x} Y={y} Z={z}")
         elif x and y:
-            self.send_command(f"S X={x} Y={y}")
+            self.query(f"S X={x} Y={y}")
         elif x and z:
-            self.send_command(f"S X={x} Z={z}")
+            self.query(f"S X={x} Z={z}")
         elif y and z:
-            self.send_command(f"S Y={y} Z={z}")
+            self.query(f"S Y={y} Z={z}")
         elif x:
-            self.send_command(f"S X={x}")
+            self.query(f"S X={x}")
         elif y:
-            self.send_command(f"S Y={y}")
+            self.query(f"S Y={y}")
         elif z:
-            self.send_command(f"S Z={z}")
-        else:
-            return
-        self.read_response()
+            self.query(f"S Z={z}")
 
     def home_all(self):
         """Home all axes"""
-        self.send_command("! X Y Z")
-        self.read_response()
+        self.query("! X Y Z")
 
     def home_axis(self, axis: str):
         """Home specifc axis"""
-        self.send_command(f"! {axis}")
-        self.read_response()
+        self.query(f"! {axis}")
 
     def load_buffer(self, x: int = 0, y: int = 0, z: int = 0):
         """Load ring buffer (max 50 positions)"""
-        self.send_command(f"LD X={x} Y={y} Z={z}")
-        self.read_response()
+        self.query(f"LD X={x} Y={y} Z={z}")
 
     def set_max_speed(self, axis: str, speed: int):
         "Set the speed (mm/s) for a specific axis"
-        self.send_command(f"S {axis}={speed}")
-        self.read_response()
-
-    def scan_x_axis_enc(self, start: int, num_pix: int, enc_divide: int = 35):
-        self.ttl("X", 1)
-        self.send_command(f"NR X={start} Z={enc_divide} F={num_pix}")
-        self.read_response()
-        self.send_command("SN X=1 Y=0 Z=0 F=0")
-        self.read_response()
-        self.send_command("SN")
-        self.read_response()
+        self.query(f"S {axis}={speed}")
+
+    def scan_x_axis_enc(
+        self, start: int, num_pix: int, enc_divide: int = 35, stop: float = None
+    ):
+        """Encoder-triggered x-axis scan of num_pix pulses from start
+
+        Give stop to set the scan direction, e.g. stop < start scans
+        towards negative x for the return rows of a serpentine raster
+        """
+        scan_range = f"X={start}" if stop is None else f"X={start} Y={stop}"
+        with self.batch() as batch:
+            batch.add("TTL X=1")
+            batch.add(f"NR {scan_range} Z={enc_divide} F={num_pix}")
+            batch.add("SN X=1 Y=0 Z=0 F=0")
+            batch.add("SN")
 
     def scan_x_axis(self, start: int, stop: int):
-        # set ttl to output at x constant move
-        self.ttl("Y", 3)
-        self.send_command(f"NR X={start} Y={stop}")
-        self.read_response()
-        self.send_command("SN X=1 Y=0 Z=0 F=0")
-        self.read_response()
-        self.send_command("SN")
-        self.read_response()
+        with self.batch() as batch:
+            # set ttl to output at x constant move
+            batch.add("TTL Y=3")
+            batch.add(f"NR X={start} Y={stop}")
+            batch.add("SN X=1 Y=0 Z=0 F=0")
+            batch.add("SN")
 
     def scan_y_axis(self, start: int, stop: int):
-        # set ttl to output at y constant move
-        self.ttl("Y", 4)
-        self.send_command(f"NR X={start} Y={stop}")
-        self.read_response()
-        self.send_command("SN X=0 Y=1 Z=0 F=0")
-        self.read_response()
-        self.send_command("SN")
-        self.read_response()
+        with self.batch() as batch:
+            # set ttl to output at y constant move
+            batch.add("TTL Y=4")
+            batch.add(f"NR X={start} Y={stop}")
+            batch.add("SN X=0 Y=1 Z=0 F=0")
+            batch.add("SN")
 
     def set_ring_buffer(self, axis_byte: int = 15):
         """Configure ring buffer for individual axis control"""
-        self.send_command(f"RM Y={axis_byte}")
-        self.read_response()
+        self.query(f"RM Y={axis_byte}")
 
     def ttl(self, axis: str = "X", mode: int = 0):
-        self.send_command(f"TTL {axis}={mode}")
-        self.read_response()
+        self.query(f"TTL {axis}={mode}")
 
     def get_position(self, axis: str) -> int:
         """Return position of the stage in ASI units (tenths of microns)"""
-        self.send_command(f"WHERE {axis}")
-        response = self.read_response()
+        response = self.query(f"WHERE {axis}")
         return int(response.split(" ")[1])
 
     def get_position_um(self, axis: str) -> float:
@@ -205,57 +330,96 @@ class MS2000(SerialPort):
 
     def set_origin(self):
         """Sets current position as origin point"""
-        self.send_command("Z")
-        self.read_response()
+        self.query("Z")
 
     def halt_all_motion(self):
         """Stop all active motors"""
-        self.send_command("\\")
-        self.read_response()
+        self.query("\\")
 
     def save_settings(self):
         """Save settings to flash memory"""
-        self.send_command("SS Z")
-        self.read_response()
+        self.query("SS Z")
 
     def get_crisp_state(self):
         """Query CRISP state"""
-        self.send_command("LK X?")
-        return self.read_response()[-1]
+        return self.query("LK X?")[-1]
 
     def lock_crisp(self):
         """Lock CRISP autofocus module"""
-        self.send_command("LK F=83")
-        self.read_response()
+        self.query("LK F=83")
 
     def set_crisp_state(self, state: str = "LOCK"):
         """Query CRISP state"""
         if state == "LOCK":
-            self.send_command("LK F=83")
-            self.read_response()
+            self.query("LK F=83")
         elif state == "UNLOCK":
-            self.send_command("UL")
-            self.read_response()
+            self.query("UL")
 
     # ------------------------------ #
     #    MS2000 Utility Functions    #
     # ------------------------------ #
 
+    def batch(self, raise_errors: bool = True) -> CommandBatch:
+        """Return a batch that sends queued commands in one round-trip"""
+        return CommandBatch(self, raise_errors)
+
     def is_device_busy(self) -> bool:
         """Returns True if axis is busy"""
-        self.send_command("/")
-        if "B" in self.read_response():
+        if "B" in self.query("/"):
             return True
         else:
             return False
 
-    def wait_for_device(self, report: bool = False):
-        """Wait for all motors to reach target positions"""
+    def wait_for_device(
+        self,
+        report: bool = False,
+        poll_interval: float = 0.01,
+        backoff: float = 1.5,
+        max_interval: float = 0.25,
+        timeout: float = None,
+    ):
+        """Wait for all motors to reach target positions
+
+        The status is polled every poll_interval seconds, growing by the
+        backoff factor up to max_interval so long moves do not flood the
+        serial link. Raises TimeoutError if the motors are still busy after
+        timeout seconds
+        """
         if not report:
             print("Waiting for device...")
         temp = self.report
         self.report = report
-        busy = True
-        while busy:
-            busy = self.is_device_busy()
-        self.report = temp
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = poll_interval
+
+        try:
+            while self.is_device_busy():
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Stage still busy after {timeout} s")
+
+                time.sleep(interval)
+                interval = min(interval * backoff, max_interval)
+        finally:
+            self.report = temp
+
+    def wait_for_device_async(self, **kwargs) -> Future:
+        """Wait for the motors on a background thread
+
+        Returns a concurrent.futures.Future so other setup (camera config,
+        ROI zones) can proceed while the stage settles. Call result() to
+        block until the motors stop, or wrap it with asyncio.wrap_future to
+        await it. Keyword arguments are passed to wait_for_device
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="ms2000-wait"
+            )
+        return self._executor.submit(self.wait_for_device, **kwargs)
+
+    def close(self):
+        """Finish background waits before closing the port"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        super().close()
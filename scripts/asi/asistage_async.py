@@ -0,0 +1,240 @@
+# ===============================================================================
+#    asyncio driver for ASI stage
+# ===============================================================================
+
+import asyncio
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from asi.asistage import SerialPort, MS2000, ASIError, parse_error
+
+
+class AsyncSerialPort:
+    """Asyncio interface to the RS232 serial connection
+
+    Commands are written directly and each request waits on a future. A
+    single reader task reads reply lines and resolves the oldest pending
+    future, since the controller answers in order. A reply that does not
+    arrive in time fails every request in flight and the input is flushed,
+    so later replies are matched to the right requests again. Blocking
+    reads run on a dedicated thread, so this also works with Windows COM
+    ports
+    """
+
+    def __init__(self, port: str, baudrate: int, read_timeout: float = 0.1):
+        self.port = SerialPort(port, baudrate)
+        self.serial_port = self.port.serial_port
+
+        # short timeout lets the reader notice when the port is closing
+        self.serial_port.timeout = read_timeout
+
+        self._pending = deque()
+        self._write_lock = None
+        self._reader_task = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ms2000-reader"
+        )
+        self._closing = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """Start the reader task on the running event loop"""
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.get_running_loop().create_task(self._reader())
+
+    async def _reader(self):
+        loop = asyncio.get_running_loop()
+
+        while not self._closing:
+            line = await loop.run_in_executor(self._executor, self.serial_port.readline)
+            if not line:
+                continue
+
+            response = line.decode("utf-8", "ignore").strip()
+
+            if self._pending:
+                _, future = self._pending.popleft()
+
+                # replies to cancelled requests are dropped
+                if not future.done():
+                    future.set_result(response)
+
+    async def submit(self, command: str) -> asyncio.Future:
+        """Write a command and return the future of its reply
+
+        Futures are queued in write order, so several commands can be in
+        flight at once
+        """
+        async with self._write_lock:
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((command, future))
+            self.serial_port.write((command + "\r").encode())
+        return future
+
+    async def query(self, command: str, timeout: float = 1.0) -> str:
+        """Send a command and await its reply
+
+        Raises ASIError if the controller replies with an error code or
+        does not reply within timeout seconds
+        """
+        return (await self.query_many([command], timeout))[0]
+
+    async def query_many(self, commands: list, timeout: float = 1.0) -> list:
+        """Pipeline several commands and await all replies in order"""
+        futures = [await self.submit(command) for command in commands]
+
+        try:
+            responses = await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except asyncio.TimeoutError:
+            self._resync()
+            command = next(
+                (c for c, f in zip(commands, futures) if f.cancelled()), commands[-1]
+            )
+            raise ASIError(command, "") from None
+
+        for command, response in zip(commands, responses):
+            if parse_error(response):
+                raise ASIError(command, response)
+
+        return responses
+
+    def _resync(self):
+        # a lost reply would be matched to the next request, so give up on
+        # everything in flight and drop replies that arrive late
+        for command, future in self._pending:
+            if not future.done():
+                future.set_exception(ASIError(command, ""))
+        self._pending.clear()
+        self.serial_port.reset_input_buffer()
+
+    async def close(self):
+        """Stop the reader task and close the serial port"""
+        self._closing = True
+        if self._reader_task is not None:
+            await self._reader_task
+            self._reader_task = None
+
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+        self._executor.shutdown(wait=True)
+        self.port.close()
+
+
+class AsyncMS2000(AsyncSerialPort):
+    """Awaitable serial connection to MS2000 controller
+
+    Motion methods accept wait=True to await completion. Cancelling a
+    waiting task halts all motors before the cancellation propagates.
+
+        async with AsyncMS2000("COM3") as stage:
+            await stage.move_axis("Y", 0, wait=True)
+    """
+
+    def __init__(self, port: str, baudrate: int = 115200):
+        # validate user baudrate
+        if baudrate not in MS2000.BAUDRATES:
+            raise ValueError(
+                "Invalid baudrate. Valid rates include 9600, 19200, 28800, 115200"
+            )
+        super().__init__(port, baudrate)
+
+    async def _motion(self, *commands: str, wait: bool = False):
+        await self.query_many(list(commands))
+
+        if wait:
+            await self.wait_for_device()
+
+    async def move(
+        self, x: int = 0, y: int = 0, z: int = 0, f: int = 0, wait: bool = False
+    ):
+        """Absolute stage translation"""
+        await self._motion(f"M X={x} Y={y} Z={z} F={f}", wait=wait)
+
+    async def move_axis(self, axis: str, dist: int, wait: bool = False):
+        """Absolute translation for specific axis"""
+        await self._motion(f"M {axis}={dist}", wait=wait)
+
+    async def moverel(
+        self, x: int = 0, y: int = 0, z: int = 0, f: int = 0, wait: bool = False
+    ):
+        """Relative stage translation"""
+        await self._motion(f"R X={x} Y={y} Z={z} F={f}", wait=wait)
+
+    async def moverel_axis(self, axis: str, dist: int, wait: bool = False):
+        """Relative translation for specific axis"""
+        await self._motion(f"R {axis}={dist}", wait=wait)
+
+    async def set_speed(self, **speeds: float):
+        """Set motor velocity in mm/s, e.g. set_speed(x=1, y=1)"""
+        params = " ".join(f"{axis.upper()}={val}" for axis, val in speeds.items())
+        if params:
+            await self.query(f"S {params}")
+
+    async def scan_x_axis_enc(
+        self,
+        start: int,
+        num_pix: int,
+        enc_divide: int = 35,
+        stop: float = None,
+        wait: bool = False,
+    ):
+        """Start an encoder-triggered x-axis scan, see MS2000.scan_x_axis_enc"""
+        scan_range = f"X={start}" if stop is None else f"X={start} Y={stop}"
+        await self._motion(
+            "TTL X=1",
+            f"NR {scan_range} Z={enc_divide} F={num_pix}",
+            "SN X=1 Y=0 Z=0 F=0",
+            "SN",
+            wait=wait,
+        )
+
+    async def get_position(self, axis: str) -> int:
+        """Return position of the stage in ASI units (tenths of microns)"""
+        response = await self.query(f"WHERE {axis}")
+        return int(response.split(" ")[1])
+
+    async def get_crisp_state(self) -> str:
+        """Query CRISP state"""
+        response = await self.query("LK X?")
+        return response[-1]
+
+    async def halt_all_motion(self):
+        """Stop all active motors"""
+        await self.query("\\")
+
+    async def is_device_busy(self) -> bool:
+        """Returns True if axis is busy"""
+        return "B" in await self.query("/")
+
+    async def wait_for_device(
+        self,
+        poll_interval: float = 0.01,
+        backoff: float = 1.5,
+        max_interval: float = 0.25,
+        timeout: float = None,
+    ):
+        """Await all motors reaching their target positions
+
+        Raises asyncio.TimeoutError after timeout seconds. If the waiting
+        task is cancelled, all motion is halted first
+        """
+        try:
+            await asyncio.wait_for(
+                self._poll_busy(poll_interval, backoff, max_interval), timeout
+            )
+        except asyncio.CancelledError:
+            await asyncio.shield(self.halt_all_motion())
+            raise
+
+    async def _poll_busy(self, interval: float, backoff: float, max_interval: float):
+        while await self.is_device_busy():
+            await asyncio.sleep(interval)
+            interval = min(interval * backoff, max_interval)
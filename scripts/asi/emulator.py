@@ -0,0 +1,416 @@
+# ===============================================================================
+#    Software emulator for the ASI MS2000 controller
+#
+#    Speaks the ASI text protocol over a pseudo-terminal so the MS2000 class
+#    can be exercised without hardware (POSIX only):
+#
+#       emulator = MS2000Emulator(latency=0.002)
+#       stage = MS2000(emulator.start())
+# ===============================================================================
+
+import os
+import math
+import time
+import threading
+
+# unit conversions (ASI units are 1/10 um)
+UNITS_PER_MM = 1e4
+UNITS_PER_ENC_COUNT = 0.1  # linear encoders have 10 nm resolution
+
+# ring buffer capacity of the controller
+BUFFER_SIZE = 50
+
+# command aliases
+ALIASES = {
+    "MOVE": "M",
+    "MOVREL": "R",
+    "SPEED": "S",
+    "WHERE": "W",
+    "STATUS": "/",
+    "HALT": "\\",
+    "HOME": "!",
+    "ZERO": "Z",
+    "LOAD": "LD",
+    "RBMODE": "RM",
+    "SCANR": "NR",
+    "SCANV": "NV",
+    "SCAN": "SN",
+    "SAVESET": "SS",
+    "LOCK": "LK",
+    "UNLOCK": "UL",
+}
+
+
+class Axis:
+    """Linear motion model of a single axis"""
+
+    def __init__(self, speed: float):
+        self.speed = speed  # mm/s
+        self.start = 0.0
+        self.target = 0.0
+        self.t_start = 0.0
+        self.duration = 0.0
+
+    def position(self, now: float) -> float:
+        if self.duration <= 0 or now >= self.t_start + self.duration:
+            return self.target
+        frac = (now - self.t_start) / self.duration
+        return self.start + frac * (self.target - self.start)
+
+    def busy(self, now: float) -> bool:
+        return now < self.t_start + self.duration
+
+    def move_to(self, target: float, now: float):
+        self.start = self.position(now)
+        self.target = target
+        self.t_start = now
+        self.duration = abs(target - self.start) / (self.speed * UNITS_PER_MM)
+
+    def halt(self, now: float):
+        self.target = self.position(now)
+        self.start = self.target
+        self.duration = 0.0
+
+
+class MS2000Emulator:
+    """Emulate the MS2000 serial protocol
+
+    Models axis positions and motion time from the axis speeds, the B/N
+    busy status, the TTL-driven ring buffer (LD/RM), encoder scans
+    (NR/SN), CRISP lock state (LK/UL), and :N-x error replies. Every reply
+    is delayed by latency seconds to mimic the serial round-trip. Setting
+    drop_replies to n swallows the next n replies, like a noisy link
+    """
+
+    def __init__(self, latency: float = 0.002, crisp_state: str = "R"):
+        self.latency = latency
+        self.crisp_state = crisp_state
+
+        self.axes = {
+            "X": Axis(speed=1.0),
+            "Y": Axis(speed=1.0),
+            "Z": Axis(speed=0.5),
+            "F": Axis(speed=10.0),
+        }
+
+        self.ring_buffer = []
+        self.buffer_pointer = 0
+        self.buffer_axes = 15
+        self.buffer_mode = 1
+        self.ttl_mode = {}
+        self.scan_params = {}
+
+        self.commands_received = 0
+        self.drop_replies = 0
+        self.lock = threading.Lock()
+
+        self._master = None
+        self._thread = None
+
+    # --------------------- #
+    #    Serial transport   #
+    # --------------------- #
+
+    def start(self) -> str:
+        """Serve the emulator on a new pseudo-terminal
+
+        Returns the device name to pass as the serial port
+        """
+        import pty
+        import tty
+
+        self._master, slave = pty.openpty()
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return name
+
+    def _serve(self):
+        buf = b""
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                # pseudo-terminal was closed
+                return
+            if not data:
+                return
+
+            buf += data
+            while b"\r" in buf:
+                line, buf = buf.split(b"\r", 1)
+                response = self.handle(line.decode("ascii", "ignore"))
+
+                if self.drop_replies > 0:
+                    self.drop_replies -= 1
+                    continue
+
+                if self.latency:
+                    time.sleep(self.latency)
+                os.write(self._master, (response + "\r\n").encode())
+
+    def stop(self):
+        """Close the pseudo-terminal"""
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
+
+    # -------------------- #
+    #    Protocol logic    #
+    # -------------------- #
+
+    def handle(self, line: str) -> str:
+        """Return the controller reply to a single command line"""
+        tokens = line.strip().split()
+        if not tokens:
+            return ":N-1"
+
+        command = tokens[0].upper()
+        command = ALIASES.get(command, command)
+        args = tokens[1:]
+
+        with self.lock:
+            self.commands_received += 1
+            handler = getattr(self, "_cmd_" + self._handler_name(command), None)
+            if handler is None:
+                return ":N-1"
+            try:
+                return handler(args, time.monotonic())
+            except KeyError:
+                return ":N-2"
+            except ValueError:
+                return ":N-4"
+
+    @staticmethod
+    def _handler_name(command: str) -> str:
+        names = {"/": "status", "\\": "halt", "!": "home"}
+        return names.get(command, command.lower())
+
+    @staticmethod
+    def _parse(args: list) -> dict:
+        """Split AXIS=value arguments, queries map to None"""
+        params = {}
+        for arg in args:
+            if "=" in arg:
+                axis, val = arg.split("=", 1)
+                params[axis.upper()] = float(val)
+            else:
+                params[arg.rstrip("?").upper()] = None
+        return params
+
+    def busy(self, now: float) -> bool:
+        return any(axis.busy(now) for axis in self.axes.values())
+
+    def trigger(self):
+        """Emulate a TTL pulse, advancing the ring buffer"""
+        with self.lock:
+            self._advance(time.monotonic())
+
+    def _advance(self, now: float):
+        # move to the next ring buffer position, the caller holds the lock
+        if not self.ring_buffer:
+            return
+        for axis, val in self.ring_buffer[self.buffer_pointer].items():
+            self.axes[axis].move_to(val, now)
+        self.buffer_pointer = (self.buffer_pointer + 1) % len(self.ring_buffer)
+
+    def _cmd_m(self, args, now):
+        params = self._parse(args)
+        if not params or None in params.values():
+            return ":N-3"
+        for axis, val in params.items():
+            self.axes[axis].move_to(val, now)
+        return ":A"
+
+    def _cmd_r(self, args, now):
+        params = self._parse(args)
+        if not params or None in params.values():
+            return ":N-3"
+        for axis, val in params.items():
+            self.axes[axis].move_to(self.axes[axis].position(now) + val, now)
+        return ":A"
+
+    def _cmd_s(self, args, now):
+        params = self._parse(args)
+        if not params:
+            return ":N-3"
+        replies = []
+        for axis, val in params.items():
+            if val is None:
+                replies.append(f"{axis}={self.axes[axis].speed:.6f}")
+            elif val <= 0:
+                raise ValueError
+            else:
+                self.axes[axis].speed = val
+        return ":A " + " ".join(replies) if replies else ":A"
+
+    def _cmd_w(self, args, now):
+        axes = [arg.upper() for arg in args] or list(self.axes)
+        positions = [str(round(self.axes[axis].position(now))) for axis in axes]
+        return ":A " + " ".join(positions)
+
+    def _cmd_status(self, args, now):
+        return "B" if self.busy(now) else "N"
+
+    def _cmd_halt(self, args, now):
+        for axis in self.axes.values():
+            axis.halt(now)
+        return ":A"
+
+    def _cmd_home(self, args, now):
+        axes = [arg.upper() for arg in args] or list(self.axes)
+        for axis in axes:
+            self.axes[axis].move_to(0.0, now)
+        return ":A"
+
+    def _cmd_z(self, args, now):
+        for axis in self.axes.values():
+            axis.halt(now)
+            axis.start = axis.target = 0.0
+        return ":A"
+
+    def _cmd_ld(self, args, now):
+        params = self._parse(args)
+        if not params or None in params.values():
+            return ":N-3"
+        if len(self.ring_buffer) >= BUFFER_SIZE:
+            return ":N-4"
+        for axis in params:
+            # validate axis names
+            self.axes[axis]
+        self.ring_buffer.append(params)
+        return ":A"
+
+    def _cmd_rm(self, args, now):
+        params = self._parse(args)
+        if not params:
+            # RM without arguments acts like a TTL trigger
+            self._advance(now)
+            return ":A"
+
+        replies = []
+        for key, val in params.items():
+            if key == "X":
+                if val is None:
+                    replies.append(f"X={len(self.ring_buffer)}")
+                else:
+                    # clear the buffer
+                    self.ring_buffer = []
+                    self.buffer_pointer = 0
+            elif key == "Y":
+                if val is None:
+                    replies.append(f"Y={self.buffer_axes}")
+                else:
+                    self.buffer_axes = int(val)
+            elif key == "Z":
+                replies.append(f"Z={self.buffer_pointer}")
+            elif key == "F":
+                if val is None:
+                    replies.append(f"F={self.buffer_mode}")
+                else:
+                    self.buffer_mode = int(val)
+            else:
+                raise KeyError(key)
+        return ":A " + " ".join(replies) if replies else ":A"
+
+    def _cmd_ttl(self, args, now):
+        params = self._parse(args)
+        if not params:
+            return ":N-3"
+        for axis, val in params.items():
+            if val is None:
+                return f":A {axis}={self.ttl_mode.get(axis, 0)}"
+            self.ttl_mode[axis] = int(val)
+        return ":A"
+
+    def _cmd_nr(self, args, now):
+        params = self._parse(args)
+        if not params:
+            return ":N-3"
+        self.scan_params.update(params)
+        return ":A"
+
+    def _cmd_nv(self, args, now):
+        return self._cmd_nr(args, now)
+
+    def _cmd_sn(self, args, now):
+        if args:
+            # scan axis selection
+            self._parse(args)
+            return ":A"
+
+        # start the encoder scan along x, towards the stop position if set
+        start = self.scan_params.get("X", 0.0) * UNITS_PER_MM
+        enc_divide = self.scan_params.get("Z", 1.0)
+        num_pix = self.scan_params.get("F", 0.0)
+        direction = (
+            -1 if self.scan_params.get("Y", math.inf) * UNITS_PER_MM < start else 1
+        )
+        stop = start + direction * num_pix * enc_divide * UNITS_PER_ENC_COUNT
+
+        axis = self.axes["X"]
+        axis.move_to(start, now)
+        if axis.duration == 0:
+            axis.move_to(stop, now)
+        else:
+            # approach the start position, then scan
+            approach = axis.duration
+            axis.start, axis.target = axis.position(now), stop
+            axis.duration = approach + abs(stop - start) / (axis.speed * UNITS_PER_MM)
+        return ":A"
+
+    def _cmd_lk(self, args, now):
+        params = self._parse(args)
+        if "X" in params and params["X"] is None:
+            return f":A {self.crisp_state}"
+        if params.get("F") == 83:
+            self.crisp_state = "F"
+        return ":A"
+
+    def _cmd_ul(self, args, now):
+        self.crisp_state = "R"
+        return ":A"
+
+    def _cmd_ss(self, args, now):
+        return ":A"
+
+    def _cmd_cca(self, args, now):
+        return ":A A: XY:L1Do Z:R1Do F:P5"
+
+    def _cmd_bu(self, args, now):
+        return ":A ADEPT_XYZPF_CRISP_RC_SCAN_ENC_INT (emulated)"
+
+
+if __name__ == "__main__":
+    # profile the blocking stage path against the emulator
+    from asi.asistage import MS2000
+
+    emulator = MS2000Emulator(latency=0.002)
+    stage = MS2000(emulator.start())
+
+    num_queries = 100
+    t_start = time.perf_counter()
+    for _ in range(num_queries):
+        stage.query("/", print_to_console=False)
+    round_trip = (time.perf_counter() - t_start) / num_queries
+    print(f"Status round-trip: {round_trip * 1e3:.2f} ms")
+
+    t_start = time.perf_counter()
+    stage.scan_x_axis_enc(start=0, num_pix=100, enc_divide=37)
+    print(f"Batched scan setup: {(time.perf_counter() - t_start) * 1e3:.2f} ms")
+    stage.halt_all_motion()
+
+    stage.set_speed(x=1, y=1)
+    stage.move(x=2000, y=2000)
+    sent = emulator.commands_received
+    t_start = time.perf_counter()
+    stage.wait_for_device(report=True)
+    print(
+        f"Settled after {time.perf_counter() - t_start:.3f} s "
+        f"with {emulator.commands_received - sent} status queries"
+    )
+
+    stage.close()
+    emulator.stop()
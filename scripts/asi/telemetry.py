@@ -0,0 +1,211 @@
+# ===============================================================================
+#    Background stage and CRISP telemetry over the shared serial link
+# ===============================================================================
+
+import math
+import time
+import queue
+import itertools
+import threading
+import numpy as np
+
+from concurrent.futures import Future
+from asi.asistage import CommandBatch
+
+# job priorities, lower values are sent first
+HIGH = 0
+LOW = 10
+
+
+class CommandScheduler(threading.Thread):
+    """Send queued stage commands from one worker thread in priority order
+
+    Each job is a list of commands sent as one batch, and equal priorities
+    run in submission order. LOW jobs only take the port while it is free,
+    so commands sent directly through the stage (moves, scans) wait for at
+    most the one transaction in flight instead of a backlog of polling
+    """
+
+    def __init__(self, stage: object, poll: float = 0.001):
+        super().__init__(daemon=True)
+        self.stage = stage
+        self.poll = poll
+
+        self.queue = queue.PriorityQueue()
+        self._order = itertools.count()
+
+    def submit(self, commands: list, priority: int = HIGH) -> Future:
+        """Queue a batch of commands, the future resolves to their replies"""
+        future = Future()
+        self.queue.put((priority, next(self._order), commands, future))
+        return future
+
+    def _acquire(self, priority: int):
+        if priority < LOW:
+            self.stage.lock.acquire()
+            return
+
+        # yield to any thread that is using the port
+        while not self.stage.lock.acquire(blocking=False):
+            time.sleep(self.poll)
+
+    def run(self):
+        while True:
+            priority, _, commands, future = self.queue.get()
+            if commands is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self._acquire(priority)
+            try:
+                batch = CommandBatch(
+                    self.stage, raise_errors=False, print_to_console=False
+                )
+                for command in commands:
+                    batch.add(command)
+                future.set_result(batch.send())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.stage.lock.release()
+
+    def close(self):
+        """Finish the queued jobs and stop the worker"""
+        self.queue.put((math.inf, next(self._order), None, None))
+        self.join()
+
+
+class TelemetrySampler(threading.Thread):
+    """Record stage position and CRISP state at a fixed rate
+
+    Samples are requested as LOW priority jobs through a CommandScheduler,
+    one round-trip each, and kept in a preallocated ring of capacity
+    samples. Ticks that fall behind schedule, e.g. while a long command
+    holds the port, are skipped rather than queued:
+
+        sampler = TelemetrySampler(stage, rate=10)
+        sampler.start()
+        ...
+        sampler.stop()
+        sampler.save(fname)
+    """
+
+    AXES = ("X", "Y", "Z", "F")
+
+    def __init__(
+        self,
+        stage: object,
+        rate: float = 10.0,
+        capacity: int = 36000,
+        scheduler: CommandScheduler = None,
+    ):
+        super().__init__(daemon=True)
+        self.rate = rate
+        self.capacity = capacity
+
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler or CommandScheduler(stage)
+
+        # seconds since start, positions in ASI units, CRISP state letter
+        self.times = np.zeros((capacity,), dtype=np.float64)
+        self.positions = np.zeros((capacity, len(self.AXES)), dtype=np.float64)
+        self.crisp = np.zeros((capacity,), dtype="S1")
+
+        # head counts all samples written
+        self.head = 0
+        self.skipped = 0
+        self.start_time = None
+
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+
+    def run(self):
+        if self._own_scheduler:
+            self.scheduler.start()
+
+        self.start_time = time.time()
+        t0 = time.monotonic()
+        period = 1 / self.rate
+        deadline = t0
+
+        try:
+            while not self._halt.is_set():
+                sent = time.monotonic()
+                where, crisp = self.scheduler.submit(
+                    [f"WHERE {' '.join(self.AXES)}", "LK X?"], LOW
+                ).result()
+
+                # reply time is taken as the middle of the round-trip
+                self._append((sent + time.monotonic()) / 2 - t0, where, crisp)
+
+                deadline += period
+                now = time.monotonic()
+                if now > deadline:
+                    missed = math.ceil((now - deadline) / period)
+                    self.skipped += missed
+                    deadline += missed * period
+
+                self._halt.wait(deadline - now)
+        except Exception as e:
+            print(f"Telemetry sampler stopped: {e}")
+        finally:
+            if self._own_scheduler:
+                self.scheduler.close()
+
+    def _append(self, t: float, where: str, crisp: str):
+        values = where.split()[1:]
+        if where.startswith(":A") and len(values) == len(self.AXES):
+            position = [float(v) for v in values]
+        else:
+            position = [math.nan] * len(self.AXES)
+
+        with self._lock:
+            i = self.head % self.capacity
+            self.times[i] = t
+            self.positions[i] = position
+            self.crisp[i] = crisp[-1:].encode() if crisp.startswith(":A") else b"?"
+            self.head += 1
+
+    def stop(self):
+        """Stop sampling after the sample in flight"""
+        self._halt.set()
+        self.join()
+
+    def series(self) -> tuple:
+        """Return (times, positions, crisp) held in the ring in time order"""
+        with self._lock:
+            if self.head <= self.capacity:
+                stop = self.head
+                return (
+                    self.times[:stop].copy(),
+                    self.positions[:stop].copy(),
+                    self.crisp[:stop].copy(),
+                )
+
+            order = np.roll(np.arange(self.capacity), -(self.head % self.capacity))
+            return self.times[order], self.positions[order], self.crisp[order]
+
+    def save(self, fname: str):
+        """Save the series as a compressed .npz file"""
+        times, positions, crisp = self.series()
+        np.savez_compressed(
+            fname,
+            time_s=times,
+            position=positions,
+            crisp=crisp,
+            axes=np.array(self.AXES),
+            start_time=self.start_time,
+            rate_hz=self.rate,
+            skipped=self.skipped,
+        )
+
+
+def load_telemetry(fname: str) -> dict:
+    """Load a saved series, positions are converted to microns"""
+    with np.load(fname) as data:
+        series = {key: data[key] for key in data.files}
+
+    series["position_um"] = series.pop("position") / 10.0
+    series["crisp"] = series["crisp"].astype(str)
+    return series
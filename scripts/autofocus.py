@@ -0,0 +1,152 @@
+# ===============================================================================
+#    Image-based autofocus on the F (piezo) axis
+#    Fallback for when CRISP cannot lock
+# ===============================================================================
+
+import time
+import warnings
+import numpy as np
+
+from asi.asistage import MS2000
+from basler.baslerace import ACA2040
+from processing.focus import METRICS, decimate, peak_position
+
+
+def sweep(
+    stage: object,
+    cam: object,
+    positions: list,
+    metric: str = "gradient",
+    roi: tuple = None,
+    step: int = 1,
+    drop: float = 0.5,
+    patience: int = 2,
+) -> tuple:
+    """Score a frame at each F position (ASI units) in order
+
+    Each frame is scored as soon as it is grabbed. The sweep ends early
+    once the score stayed below drop times the best score for patience
+    positions in a row, i.e. the focus was passed
+
+    Returns a tuple of (positions, scores) of the positions visited
+    """
+    score = METRICS[metric]
+    scores = []
+    below = 0
+
+    for z in positions:
+        stage.move_axis("F", z)
+        stage.wait_for_device(report=True)
+
+        scores.append(score(decimate(cam.grab_frame(), roi, step)))
+
+        if scores[-1] < drop * max(scores):
+            below += 1
+            if below >= patience:
+                break
+        else:
+            below = 0
+
+    return positions[: len(scores)], scores
+
+
+def autofocus(
+    stage: object,
+    cam: object,
+    range_um: float = 100.0,
+    num_steps: int = 11,
+    levels: int = 3,
+    metric: str = "gradient",
+    roi: tuple = None,
+    step: int = 4,
+    drop: float = 0.5,
+) -> float:
+    """Move the F axis to the sharpest image and return its position (um)
+
+    The first level sweeps range_um around the current position, every
+    further level sweeps the interval between the neighbors of the last
+    peak. Coarse levels score every step-th pixel of the roi, the last
+    level uses all of them
+    """
+    center = stage.get_position("F")
+    half = range_um * 10 / 2
+
+    # grab in software for the duration of the search
+    trigger_mode = cam.dev.TriggerMode.GetValue()
+    cam.dev.TriggerMode.SetValue("Off")
+
+    try:
+        for level in range(levels):
+            positions = np.unique(
+                np.round(np.linspace(center - half, center + half, num_steps))
+            ).astype(int)
+
+            positions, scores = sweep(
+                stage,
+                cam,
+                positions,
+                metric,
+                roi,
+                step if level < levels - 1 else 1,
+                drop,
+            )
+
+            i = int(np.argmax(scores))
+            if level == 0 and i in (0, len(positions) - 1):
+                warnings.warn("Best focus is at the edge of the search range")
+
+            center = peak_position(positions, scores)
+            half = max(2 * half / (num_steps - 1), 1)
+            print(f"Focus level {level}: {center / 10:.1f} um ({len(scores)} frames)")
+    finally:
+        cam.dev.TriggerMode.SetValue(trigger_mode)
+
+    stage.move_axis("F", round(center))
+    stage.wait_for_device(report=True)
+
+    return center / 10
+
+
+def ensure_focus(
+    stage: object, cam: object, lock_timeout: float = 2.0, **kwargs
+) -> bool:
+    """Lock CRISP, or fall back to image-based autofocus
+
+    Returns True if CRISP locked within lock_timeout seconds. Otherwise
+    CRISP is unlocked for the autofocus sweep, and put back into lock mode
+    afterwards if it was locking ("K") when called. Keyword arguments are
+    passed to autofocus
+    """
+    state = stage.get_crisp_state()
+    if state == "F":
+        return True
+
+    stage.lock_crisp()
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        if stage.get_crisp_state() == "F":
+            return True
+        time.sleep(0.1)
+
+    warnings.warn("CRISP not locked, focusing on the image instead")
+
+    # CRISP would keep servoing the focus while the sweep moves it
+    stage.set_crisp_state("UNLOCK")
+    try:
+        autofocus(stage, cam, **kwargs)
+    finally:
+        if state == "K":
+            stage.lock_crisp()
+
+    return False
+
+
+if __name__ == "__main__":
+    cam = ACA2040(exposure_time_us=100)
+    stage = MS2000("COM3", 115200)
+
+    focus_um = autofocus(stage, cam)
+    print(f"Best focus at F = {focus_um:.1f} um")
+
+    stage.close()
+    cam.close()
@@ -0,0 +1,167 @@
+# ===============================================================================
+#    Background frame grabbing for Basler cameras
+# ===============================================================================
+
+import threading
+import numpy as np
+
+from pypylon import pylon, genicam
+from numpy import ndarray
+
+
+class GrabStats:
+    """Per-run frame counters
+
+    grabbed     Frames copied into the ring
+    dropped     Frames lost to failed grabs, BlockID gaps, or a full ring
+    late        Frames retrieved while the ring was above its high-water mark
+    """
+
+    def __init__(self):
+        self.grabbed = 0
+        self.dropped = 0
+        self.late = 0
+
+    def __str__(self):
+        return f"grabbed: {self.grabbed}, dropped: {self.dropped}, late: {self.late}"
+
+
+class FrameRing:
+    """Preallocated ring of frame buffers
+
+    Single producer, single consumer. The producer only advances head and
+    the consumer only advances tail, so frames are handed over without a
+    lock
+    """
+
+    def __init__(self, capacity: int, shape: tuple, dtype: np.dtype = np.uint16):
+        self.capacity = capacity
+        self.frames = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        self.frame_ids = np.zeros((capacity,), dtype=np.int64)
+        self.timestamps = np.zeros((capacity,), dtype=np.uint64)
+
+        # total number of frames written and consumed
+        self.head = 0
+        self.tail = 0
+
+        # wakes the consumer when new frames arrive
+        self.ready = threading.Event()
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def push(self, frame: ndarray, frame_id: int, timestamp: int) -> bool:
+        """Copy a frame into the next free slot
+
+        Returns False if the ring is full
+        """
+        if self.head - self.tail >= self.capacity:
+            return False
+
+        slot = self.head % self.capacity
+        self.frames[slot] = frame
+        self.frame_ids[slot] = frame_id
+        self.timestamps[slot] = timestamp
+
+        # publish only after the slot is filled
+        self.head += 1
+        self.ready.set()
+        return True
+
+
+class GrabThread(threading.Thread):
+    """Drain pylon grab results into a frame ring on a dedicated thread"""
+
+    def __init__(
+        self,
+        dev: object,
+        ring: FrameRing,
+        total_frames: int,
+        timeout: int = 5000,
+        high_water: float = 0.5,
+    ):
+        super().__init__(daemon=True)
+        self.dev = dev
+        self.ring = ring
+        self.total_frames = total_frames
+        self.timeout = timeout
+        self.high_water = int(high_water * ring.capacity)
+
+        self.stats = GrabStats()
+        self.error = None
+        self._done = threading.Event()
+        self._halt = threading.Event()
+
+    def run(self):
+        last_id = None
+
+        try:
+            self.dev.StartGrabbingMax(self.total_frames, pylon.GrabStrategy_OneByOne)
+
+            while self.dev.IsGrabbing() and not self._halt.is_set():
+                # NOTE: timeout must be greater than exposure time!
+                grab_result = self.dev.RetrieveResult(
+                    self.timeout, pylon.TimeoutHandling_ThrowException
+                )
+
+                try:
+                    frame_id = grab_result.BlockID
+
+                    # gaps in the block ID are frames the host never saw
+                    if last_id is not None and frame_id > last_id + 1:
+                        self.stats.dropped += frame_id - last_id - 1
+                    last_id = frame_id
+
+                    if grab_result.GrabSucceeded():
+                        if len(self.ring) > self.high_water:
+                            self.stats.late += 1
+
+                        if self.ring.push(
+                            grab_result.Array, frame_id, grab_result.TimeStamp
+                        ):
+                            self.stats.grabbed += 1
+                        else:
+                            self.stats.dropped += 1
+                    else:
+                        self.stats.dropped += 1
+                        print(
+                            "Error: ",
+                            grab_result.ErrorCode,
+                            grab_result.ErrorDescription,
+                        )
+                finally:
+                    grab_result.Release()
+        except genicam.GenericException as e:
+            self.error = e
+            print(e)
+        finally:
+            self.dev.StopGrabbing()
+            self._done.set()
+            self.ring.ready.set()
+
+    def stop(self):
+        """Request the grab loop to exit after the current frame"""
+        self._halt.set()
+
+    def frames(self, poll: float = 0.01):
+        """Yield (frame, frame_id, timestamp) in arrival order
+
+        Frames are views into the ring and are only valid until the next
+        iteration. Iteration ends once grabbing has stopped and the ring is
+        empty
+        """
+        ring = self.ring
+
+        while True:
+            if ring.head == ring.tail:
+                if self._done.is_set() and ring.head == ring.tail:
+                    return
+                ring.ready.wait(poll)
+                ring.ready.clear()
+                continue
+
+            slot = ring.tail % ring.capacity
+            yield ring.frames[slot], ring.frame_ids[slot], ring.timestamps[slot]
+
+            # release the slot back to the producer
+            ring.tail += 1
@@ -10,7 +10,10 @@ import tifffile as tf
 from pypylon import pylon, genicam
 from pypylon.pylon import InstantCamera, TlFactory
 from numpy import ndarray
+from numpy.lib.stride_tricks import as_strided
 from nidaqmx import Task
+from basler.acquisition import FrameRing, GrabStats, GrabThread
+from basler.streaming import RowWriter, StackWriter
 
 
 class ACA2040:
@@ -23,11 +26,21 @@ class ACA2040:
         frame_width_pix: int = 2064,
         sensor_pixel_size_mm: float = 370e-6,
         num_buffers: int = 5,
+        device: object = None,
     ):
+        """Open the first attached camera, or device if given
+
+        device accepts any object with the pylon InstantCamera interface,
+        e.g. simulator.SimulatedCamera for running without hardware
+        """
         self.sensor_width_pix = 2064
         self.sensor_height_pix = 1544
         self.fps_max = 635
 
+        # every ROI zone is read out as a band of rows
+        self.zone_height_pix = 4
+        self.zone_modes = ("single", "tdi", "lines")
+
         self.pix_format = pix_format
         self.exposure_time_us = exposure_time_us
         self.frame_width_pix = frame_width_pix
@@ -36,12 +49,28 @@ class ACA2040:
 
         self.fov_height_mm = self.sensor_height_pix * self.sensor_pix_size_mm
 
+        # frame counters, block IDs and timestamps of the last acquisition
+        self.grab_stats = None
+        self.frame_ids = None
+        self.timestamps = None
+
+        # ROI zone layout written by set_roi_zones
+        self.zone_offsets = None
+
         try:
-            self.dev = InstantCamera(TlFactory.GetInstance().CreateFirstDevice())
+            if device is None:
+                device = InstantCamera(TlFactory.GetInstance().CreateFirstDevice())
+            self.dev = device
 
             # open camera port
             self.dev.Open()
 
+            # sensor rows, also the reference for zone cropping. Height.Max
+            # excludes OffsetY, which the camera keeps between sessions
+            if genicam.IsWritable(self.dev.OffsetY.GetAccessMode()):
+                self.dev.OffsetY.SetValue(0)
+            self.height_max = self.dev.Height.Max
+
             # allocate buffers for acquisitions
             self.dev.MaxNumBuffer = self.num_buffers
 
@@ -106,28 +135,62 @@ class ACA2040:
         """Return device frame rate based on current configuration"""
         return self.dev.ResultingFrameRate.GetValue()
 
-    def crop_overlap_zone(self, img_arr: ndarray) -> ndarray:
-        """Remove non-overlapping rows from each plane"""
-        # we can infer the size of the overlapping array
-        overlap_arr = np.empty(
-            (
-                img_arr.shape[0],
-                img_arr.shape[1] - self.dev.Height.Max,
-                img_arr.shape[2],
-            ),
-            dtype=np.uint16,
-        )
+    @staticmethod
+    def zone_layout(
+        num_zones: int, height_max: int = 1544, zone_height: int = 4
+    ) -> ndarray:
+        """Return the offsets of evenly-spaced ROI zones
+
+        Offsets are rounded down to a multiple of the zone height, since
+        the camera rejects any other value
+        """
+        zone_spacing = math.trunc((height_max - zone_height) / (num_zones - 1))
+        offsets = np.arange(num_zones) * zone_spacing
+        return offsets - offsets % zone_height
+
+    @staticmethod
+    def crop_overlap(img_arr: ndarray, offsets: ndarray, height_max: int) -> ndarray:
+        """Remove non-overlapping rows from each plane
 
-        for p in range(img_arr.shape[0]):
-            self.dev.ROIZoneSelector.SetValue(f"Zone{p}")
-            offset = self.dev.ROIZoneOffset.GetValue()
+        Plane p starts height_max - offsets[p] rows in and all planes keep
+        the same number of rows. Needs no camera, so it also applies to
+        saved stacks given the zone layout stored with them.
 
-            start = self.dev.Height.Max - offset
-            stop = img_arr.shape[1] - (self.dev.Height.Max - start)
+        Returns a read-only view if the zones are evenly spaced, otherwise
+        a copy
+        """
+        starts = height_max - np.asarray(offsets)
+        num_rows = img_arr.shape[1] - height_max
+        shape = (img_arr.shape[0], num_rows, img_arr.shape[2])
+
+        steps = np.diff(starts)
+        if not steps.size or np.all(steps == steps[0]):
+            step = steps[0] if steps.size else 0
+            strides = img_arr.strides
+            return as_strided(
+                img_arr[:, starts[0] :],
+                shape=shape,
+                strides=(strides[0] + step * strides[1],) + strides[1:],
+                writeable=False,
+            )
+
+        rows = starts[:, np.newaxis] + np.arange(num_rows)
+        return np.take_along_axis(img_arr, rows[:, :, np.newaxis], axis=1)
 
-            overlap_arr[p] = img_arr[p, start:stop, :]
+    def crop_overlap_zone(self, img_arr: ndarray) -> ndarray:
+        """Remove non-overlapping rows from each plane
 
-        return overlap_arr
+        Uses the zone layout cached by set_roi_zones, see crop_overlap
+        """
+        offsets = self.zone_offsets
+        if offsets is None:
+            # zones were configured outside this session
+            offsets = np.empty((img_arr.shape[0],), dtype=np.int64)
+            for p in range(img_arr.shape[0]):
+                self.dev.ROIZoneSelector.SetValue(f"Zone{p}")
+                offsets[p] = self.dev.ROIZoneOffset.GetValue()
+
+        return self.crop_overlap(img_arr, offsets[: img_arr.shape[0]], self.height_max)
 
     def set_trigger(
         self,
@@ -176,8 +239,10 @@ class ACA2040:
         These settings persist in camera memory and can affect
         future acquisitions
         """
+        self.zone_offsets = None
+
         try:
-            if genicam.IsWritable(self.dev.ROIZoneMode):
+            if genicam.IsWritable(self.dev.ROIZoneMode.GetAccessMode()):
                 for i in range(8):
                     self.dev.ROIZoneSelector.SetValue(f"Zone{i}")
                     self.dev.ROIZoneMode.SetValue("Off")
@@ -185,10 +250,10 @@ class ACA2040:
             print("Unable to reset camera ROI zones")
 
         try:
-            if genicam.IsWritable(self.dev.OffsetY):
+            if genicam.IsWritable(self.dev.OffsetY.GetAccessMode()):
                 # reset camera to full FOV
                 self.dev.OffsetY.SetValue(0)
-                self.dev.Height.SetValue(self.dev.Height.Max)
+                self.dev.Height.SetValue(self.height_max)
         except genicam.TimeoutException:
             print("Unable to reset camera y-offset")
 
@@ -196,33 +261,45 @@ class ACA2040:
         """Automate the creation of evenly-spaced ROI zones
 
         If num_zones == 1, simply set the camera height to 1 pix and
-        adjust offset accordingly
+        adjust offset accordingly. The zone layout is kept in
+        self.zone_offsets, and only zones that differ from the current
+        layout are written to the camera
         """
-        # NOTE: camera remembers previous settings!
-        self.reset_roi_zones()
-
         if num_zones > 1 and num_zones < 8:
-            zone_spacing = math.trunc((self.dev.Height.Max - 4) / (num_zones - 1))
-            zone_offset = 0
+            offsets = self.zone_layout(num_zones, self.height_max, self.zone_height_pix)
+
+            if self.zone_offsets is None:
+                # NOTE: camera remembers previous settings!
+                self.reset_roi_zones()
+                active = []
+            else:
+                active = self.zone_offsets
+
+            for i in range(max(num_zones, len(active))):
+                if i >= num_zones:
+                    changes = [("ROIZoneMode", "Off")]
+                elif i >= len(active):
+                    changes = [
+                        ("ROIZoneOffset", int(offsets[i])),
+                        ("ROIZoneSize", self.zone_height_pix),
+                        ("ROIZoneMode", "On"),
+                    ]
+                elif active[i] != offsets[i]:
+                    changes = [("ROIZoneOffset", int(offsets[i]))]
+                else:
+                    continue
 
-            for i in range(num_zones):
                 self.dev.ROIZoneSelector.SetValue(f"Zone{i}")
-                try:
-                    self.dev.ROIZoneOffset.SetValue(zone_offset)
-                except genicam.OutOfRangeException:
-                    # camera offset must be divisible by minimum zone pix height
-                    adjusted_offset = zone_offset
-                    while adjusted_offset % 4:
-                        adjusted_offset -= 1
-                    self.dev.ROIZoneOffset.SetValue(adjusted_offset)
-                self.dev.ROIZoneSize.SetValue(4)
-                self.dev.ROIZoneMode.SetValue("On")
-
-                zone_offset += zone_spacing
+                for node, value in changes:
+                    getattr(self.dev, node).SetValue(value)
+
+            self.zone_offsets = offsets
         elif num_zones == 1:
+            self.reset_roi_zones()
             self.dev.Height.SetValue(1)
             self.dev.OffsetY.SetValue(self.sensor_height_pix / 2)
         else:
+            self.reset_roi_zones()
             warnings.warn("Requested ROI zones is outside hardware configuration")
 
     def acquire_sequence(self, total_acqs: int, timeout: int = 5000) -> ndarray:
@@ -259,56 +336,353 @@ class ACA2040:
 
             return img_seq
 
+    def grab_frame(self, timeout: int = 1000) -> ndarray:
+        """Grab a single frame, e.g. for focusing
+
+        The camera must be free-running (trigger mode off)
+        """
+        grab_result = self.dev.GrabOne(timeout)
+        try:
+            if not grab_result.GrabSucceeded():
+                raise RuntimeError(
+                    f"Grab failed: {grab_result.ErrorCode} "
+                    f"{grab_result.ErrorDescription}"
+                )
+            return grab_result.Array
+        finally:
+            grab_result.Release()
+
+    def acquire_zstack(
+        self,
+        num_slices: int,
+        fname: str = None,
+        timeout: int = 5000,
+        ring_size: int = 8,
+        description: dict = None,
+        segment_size: int = None,
+        before_segment=None,
+    ) -> ndarray:
+        """Acquire full frames into a preallocated z/y/x stack
+
+        Frames are drained on a background thread and copied into the
+        stack, and with fname given each slice is written to a multi-page
+        TIFF by a writer thread as soon as it is filled. Neither step
+        encodes or waits on disk I/O in the grab loop, so z-sweeps run at
+        camera speed. Use "Mono12" or "Mono12p" to keep the full 12 bits.
+        The ring only has to cover the copy into the stack, so it holds
+        ring_size full frames at most
+
+        With segment_size, frames are grabbed in runs of at most that many
+        frames and the camera stops exposing in between. before_segment(k)
+        is called before run k starts, e.g. to reload the stage ring buffer,
+        and must block until the stage is ready
+
+        Returns the stack, slices that were not recorded stay zero
+        """
+        shape = (self.dev.Height.GetValue(), self.dev.Width.GetValue())
+        stack = np.zeros((num_slices,) + shape, np.uint16)
+        segment_size = segment_size or num_slices
+
+        writer = None
+        if fname is not None:
+            writer = StackWriter(fname, stack, description)
+            writer.start()
+
+        acq_counter = 0
+
+        ring = FrameRing(min(ring_size, segment_size), shape)
+        frame_ids = np.empty((num_slices,), dtype=np.int64)
+        timestamps = np.empty((num_slices,), dtype=np.uint64)
+
+        stats = GrabStats()
+
+        try:
+            for k, start in enumerate(range(0, num_slices, segment_size)):
+                if before_segment is not None:
+                    before_segment(k)
+
+                total = min(segment_size, num_slices - start)
+                grabber = GrabThread(self.dev, ring, total, timeout)
+                grabber.start()
+
+                try:
+                    for frame, frame_id, timestamp in grabber.frames():
+                        stack[acq_counter] = frame
+                        frame_ids[acq_counter] = frame_id
+                        timestamps[acq_counter] = timestamp
+
+                        if writer is not None:
+                            writer.put(acq_counter)
+                        acq_counter += 1
+                finally:
+                    grabber.stop()
+                    grabber.join()
+
+                    stats.grabbed += grabber.stats.grabbed
+                    stats.dropped += grabber.stats.dropped
+                    stats.late += grabber.stats.late
+
+                # later slices would be recorded at the wrong positions
+                if acq_counter < start + total:
+                    break
+        finally:
+            if writer is not None:
+                writer.close()
+
+            self.grab_stats = stats
+            self.frame_ids = frame_ids[:acq_counter]
+            self.timestamps = timestamps[:acq_counter]
+
+            print(f"Total slices requested: {num_slices}")
+            print(f"Total slices recorded: {acq_counter}")
+            print(f"Frame counters: {stats}")
+
+        # slices written after the last put can still fail
+        if writer is not None:
+            writer.check()
+
+        return stack
+
+    def rows_per_frame(self, zone_mode: str = "single") -> int:
+        """Return the number of scan lines the stage advances per frame
+
+        Only "lines" mode maps the rows of each zone to consecutive scan
+        lines, so stage velocity and encoder divide scale with it
+        """
+        if zone_mode not in self.zone_modes:
+            raise ValueError(f"zone_mode must be one of {self.zone_modes}")
+        return self.zone_height_pix if zone_mode == "lines" else 1
+
+    def place_zone_rows(
+        self,
+        out: ndarray,
+        row: int,
+        frame: ndarray,
+        num_zones: int,
+        zone_mode: str,
+        reverse: bool = False,
+    ):
+        """Copy the zone rows of a frame into out, starting at row
+
+        single  First row of each zone
+        tdi     Zone row j images the scan line row 0 sees j frames later,
+                so all rows are summed into consecutive lines (time-delay
+                integration). out must be zeroed first, and the sums are
+                averaged with normalize_tdi once all frames are placed
+        lines   The stage advances a full zone height per frame, so the
+                rows of each zone are consecutive scan lines
+
+        In a reverse scan the lines cross the zone rows the other way, so
+        the zone rows are placed last to first
+        """
+        rows = self.zone_height_pix
+        if zone_mode == "single":
+            out[:, row] = frame[: num_zones * rows : rows]
+            return
+
+        zones = frame[: num_zones * rows].reshape(num_zones, rows, -1)
+        if reverse:
+            zones = zones[:, ::-1]
+
+        # rows past the end of the stack are dropped
+        stop = min(rows, out.shape[1] - row)
+        if zone_mode == "tdi":
+            # 4 x 12-bit sums still fit into 16 bits
+            out[:, row : row + stop] += zones[:, :stop]
+        else:
+            out[:, row : row + stop] = zones[:, :stop]
+
+    def normalize_tdi(self, out: ndarray, start: int, num_frames: int):
+        """Divide summed tdi rows in place by the number of frames summed
+
+        out holds the rows from start on of a stack of num_frames placed
+        frames. Rows within zone_height_pix - 1 of either end of the stack
+        are covered by fewer frames than the rest
+        """
+        lines = np.arange(start, start + out.shape[1])
+        counts = (
+            np.minimum(lines, num_frames - 1)
+            - np.maximum(lines - self.zone_height_pix + 1, 0)
+            + 1
+        )
+        counts = np.clip(counts, 1, None).astype(np.uint16)[None, :, None]
+
+        # round to nearest
+        out += counts // 2
+        out //= counts
+
     def acquire_stack(
         self,
         num_zones: int = 3,
         total_row_acq: int = 1544,
         frame_width: int = 2064,
         timeout: int = 5000,
+        ring_size: int = 256,
+        zone_mode: str = "single",
+        reverse: bool = False,
     ) -> ndarray:
         """Initiate acquisition and process incoming frames in real time
 
+        Frames are drained from pylon on a background thread into a ring of
+        preallocated buffers while this thread extracts the zone rows.
+        Frame counters for the run are kept in self.grab_stats, and the
+        block ID and timestamp of each recorded frame in self.frame_ids and
+        self.timestamps
+
+        zone_mode selects how the rows of each zone are used (see
+        place_zone_rows), reverse=True for scans in the negative direction.
+        In "lines" mode only total_row_acq / 4 frames are grabbed, and the
+        stage must advance 4 rows per frame
+
         Returns a multidimensional numpy image array
         """
+        step = self.rows_per_frame(zone_mode)
+        total_frames = -(-total_row_acq // step)
 
         # initialize imaging data array
-        reconstruction = np.empty((num_zones, total_row_acq, frame_width), np.uint16)
+        reconstruction = np.zeros(
+            (num_zones, total_frames * step, frame_width), np.uint16
+        )
 
         # initialize counter to track acquisitions
         acq_counter = 0
 
         print(f"total row acq: {total_row_acq}")
 
-        try:
-            self.dev.StartGrabbingMax(total_row_acq)
+        ring = FrameRing(
+            ring_size, (self.dev.Height.GetValue(), self.dev.Width.GetValue())
+        )
+        frame_ids = np.empty((total_frames,), dtype=np.int64)
+        timestamps = np.empty((total_frames,), dtype=np.uint64)
 
-            while self.dev.IsGrabbing():
-                # NOTE: timeout must be greater than exposure time!
-                grab_result = self.dev.RetrieveResult(
-                    timeout, pylon.TimeoutHandling_ThrowException
-                )
-                print(acq_counter)
+        grabber = GrabThread(self.dev, ring, total_frames, timeout)
+        grabber.start()
 
-                if grab_result.GrabSucceeded():
-                    for i in range(num_zones):
-                        reconstruction[i][acq_counter] = grab_result.Array[
-                            i * 4
-                        ].reshape((1, 2064))
-                    acq_counter += 1
-                else:
-                    print(
-                        "Error: ", grab_result.ErrorCode, grab_result.ErrorDescription
-                    )
-                grab_result.Release()
-        except genicam.GenericException as e:
-            print(e)
+        try:
+            for frame, frame_id, timestamp in grabber.frames():
+                self.place_zone_rows(
+                    reconstruction,
+                    acq_counter * step,
+                    frame,
+                    num_zones,
+                    zone_mode,
+                    reverse,
+                )
+                frame_ids[acq_counter] = frame_id
+                timestamps[acq_counter] = timestamp
+                acq_counter += 1
         finally:
-            self.dev.StopGrabbing()
+            grabber.stop()
+            grabber.join()
+
+            self.grab_stats = grabber.stats
+            self.frame_ids = frame_ids[:acq_counter]
+            self.timestamps = timestamps[:acq_counter]
 
-            print(f"Total images requested: {total_row_acq}")
+            print(f"Total images requested: {total_frames}")
             print(f"Total images recorded: {acq_counter}")
+            print(f"Frame counters: {grabber.stats}")
+
+        reconstruction = reconstruction[:, :total_row_acq]
+        if zone_mode == "tdi":
+            self.normalize_tdi(reconstruction, 0, acq_counter)
+
+        return reconstruction
+
+    def stream_stack(
+        self,
+        fname: str,
+        num_zones: int = 3,
+        total_row_acq: int = 1544,
+        frame_width: int = 2064,
+        timeout: int = 5000,
+        ring_size: int = 256,
+        block_rows: int = 256,
+        zone_mode: str = "single",
+        reverse: bool = False,
+    ) -> int:
+        """Acquire a stack and stream rows to a memory-mapped file on disk
+
+        Memory use stays constant regardless of scan length. Rows recorded
+        before an interruption remain readable with streaming.read_stream.
+        zone_mode and reverse are as in acquire_stack, and block_rows must be
+        a multiple of 4 in "lines" mode. A failed write stops the
+        acquisition with a RuntimeError
+
+        Returns the number of rows written
+        """
+        step = self.rows_per_frame(zone_mode)
+        total_frames = -(-total_row_acq // step)
+
+        # blocks are written once a frame fills their last row
+        if block_rows % step:
+            raise ValueError(
+                f"block_rows must be a multiple of {step} in {zone_mode!r} mode"
+            )
+
+        # TDI sums spill over into the first rows of the next block
+        carry = self.zone_height_pix - 1 if zone_mode == "tdi" else 0
+
+        writer = RowWriter(fname, num_zones, total_frames * step, frame_width)
+        writer.start()
+
+        ring = FrameRing(
+            ring_size, (self.dev.Height.GetValue(), self.dev.Width.GetValue())
+        )
+        grabber = GrabThread(self.dev, ring, total_frames, timeout)
+        grabber.start()
+
+        block = np.zeros((num_zones, block_rows + carry, frame_width), np.uint16)
+        block_start = 0
+        acq_counter = 0
+
+        frame_ids = np.empty((total_frames,), dtype=np.int64)
+        timestamps = np.empty((total_frames,), dtype=np.uint64)
+
+        try:
+            for frame, frame_id, timestamp in grabber.frames():
+                row = acq_counter * step
+                self.place_zone_rows(
+                    block, row - block_start, frame, num_zones, zone_mode, reverse
+                )
+                frame_ids[acq_counter] = frame_id
+                timestamps[acq_counter] = timestamp
+                acq_counter += 1
+
+                if row + step - block_start == block_rows:
+                    if zone_mode == "tdi":
+                        self.normalize_tdi(
+                            block[:, :block_rows], block_start, acq_counter
+                        )
+                    writer.put(block_start, block[:, :block_rows])
+
+                    tail = block[:, block_rows:]
+                    block = np.zeros_like(block)
+                    block[:, :carry] = tail
+                    block_start += block_rows
+        finally:
+            grabber.stop()
+            grabber.join()
+
+            # write the partial block and flush everything to disk
+            if writer.error is None and acq_counter * step > block_start:
+                partial = block[:, : acq_counter * step - block_start]
+                if zone_mode == "tdi":
+                    self.normalize_tdi(partial, block_start, acq_counter)
+                writer.put(block_start, partial)
+            writer.close()
+
+            self.grab_stats = grabber.stats
+            self.frame_ids = frame_ids[:acq_counter]
+            self.timestamps = timestamps[:acq_counter]
+
+            print(f"Total images requested: {total_frames}")
+            print(f"Total images recorded: {acq_counter}")
+            print(f"Frame counters: {grabber.stats}")
+
+        writer.check()
 
-            return reconstruction
+        return writer.rows_written
 
     def close(self):
         """Housekeeping"""
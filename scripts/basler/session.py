@@ -0,0 +1,139 @@
+# ===============================================================================
+#    Persistent camera session with cached node writes
+# ===============================================================================
+
+from pypylon.pylon import InstantCamera, TlFactory
+from basler.baslerace import ACA2040
+
+# nodes whose value depends on the state of a selector node
+SELECTORS = {
+    "ROIZoneMode": "ROIZoneSelector",
+    "ROIZoneOffset": "ROIZoneSelector",
+    "ROIZoneSize": "ROIZoneSelector",
+    "LineMode": "LineSelector",
+    "LineSource": "LineSelector",
+    "LineInverter": "LineSelector",
+    "LineDebouncerTime": "LineSelector",
+    "LineMinimumOutputPulseWidth": "LineSelector",
+    "TriggerMode": "TriggerSelector",
+    "TriggerSource": "TriggerSelector",
+    "TriggerActivation": "TriggerSelector",
+}
+
+# nodes the camera also changes on its own, e.g. when ROI zones are toggled
+UNCACHED = ("Height", "OffsetY")
+
+
+class CachedNode:
+    """Camera node that skips writes of the value it already holds"""
+
+    def __init__(self, device: object, name: str, node: object):
+        self._device = device
+        self._name = name
+        self._node = node
+
+    def __getattr__(self, name: str):
+        return getattr(self._node, name)
+
+    def SetValue(self, value):
+        key = self._device.key(self._name)
+        if key is not None and self._device.values.get(key) == value:
+            self._device.skipped += 1
+            return
+
+        self._node.SetValue(value)
+        self._device.writes += 1
+
+        if key is not None:
+            self._device.values[key] = value
+
+
+class CachedDevice:
+    """Wrap a pylon camera and remember the last value written to each node
+
+    Selector-dependent nodes are cached per selector state. Everything
+    that is not a parameter node (grabbing, commands) is passed through
+    unchanged
+    """
+
+    def __init__(self, dev: object):
+        self.__dict__.update(
+            {"dev": dev, "values": {}, "writes": 0, "skipped": 0, "_nodes": {}}
+        )
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.dev, name)
+        if not hasattr(attr, "SetValue"):
+            return attr
+
+        if name not in self._nodes:
+            self._nodes[name] = CachedNode(self, name, attr)
+        return self._nodes[name]
+
+    def __setattr__(self, name: str, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.dev, name, value)
+
+    def key(self, name: str) -> tuple:
+        """Return the cache key of a node, None if it is never cached"""
+        if name in UNCACHED:
+            return None
+
+        selector = SELECTORS.get(name)
+        if selector is None:
+            return (name,)
+
+        state = self.values.get((selector,))
+        if state is None:
+            # selector was never written in this session
+            state = getattr(self.dev, selector).GetValue()
+            self.values[(selector,)] = state
+        return (name, state)
+
+    def invalidate(self):
+        """Forget all cached values
+
+        Needed if the camera was reconfigured outside this session
+        """
+        self.values.clear()
+
+    def Open(self):
+        self.invalidate()
+        self.dev.Open()
+
+
+class CameraSession:
+    """Keep one camera open and configured across repeated acquisitions
+
+    Node writes that would not change the camera state are skipped, so
+    reconfiguring between acquisitions only costs the nodes that differ.
+
+        with CameraSession(exposure_time_us=30) as cam:
+            for z in range(2, 8):
+                cam.set_trigger()
+                cam.set_roi_zones(z)
+                img = cam.acquire_stack(z, total_row_acq)
+    """
+
+    def __init__(self, device: object = None, **camera_kwargs):
+        if device is None:
+            device = InstantCamera(TlFactory.GetInstance().CreateFirstDevice())
+
+        self.device = CachedDevice(device)
+        self.cam = ACA2040(device=self.device, **camera_kwargs)
+
+    def __enter__(self) -> ACA2040:
+        return self.cam
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Reset and close the camera"""
+        self.cam.close()
+        print(
+            f"Camera node writes: {self.device.writes}, "
+            f"skipped: {self.device.skipped}"
+        )
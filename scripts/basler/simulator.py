@@ -0,0 +1,495 @@
+# ===============================================================================
+#    Simulated Basler ACA2040 camera for hardware-free acquisition
+#
+#    Drop-in replacement for the pylon InstantCamera used by ACA2040:
+#
+#       cam = ACA2040(device=SimulatedCamera(fps=635))
+# ===============================================================================
+
+import time
+import threading
+import numpy as np
+
+from pypylon import pylon, genicam
+from numpy import ndarray
+
+
+class Node:
+    """Minimal GenICam parameter node
+
+    Integer and float nodes are range checked against min/max/inc and
+    enumeration nodes against their entries, raising the same genicam
+    exceptions as the camera. max can be a callable for limits that depend
+    on other nodes. Read-only nodes take a getter
+    """
+
+    def __init__(
+        self,
+        value=None,
+        min: float = None,
+        max: float = None,
+        inc: float = None,
+        entries: tuple = None,
+        getter=None,
+    ):
+        self.value = value
+        self.min = min
+        self.max = max
+        self.inc = inc
+        self.entries = entries
+        self.getter = getter
+
+    @property
+    def Min(self):
+        return self.min
+
+    @property
+    def Max(self):
+        return self.GetMax()
+
+    @property
+    def Inc(self):
+        return self.inc
+
+    def GetMin(self):
+        return self.min
+
+    def GetMax(self):
+        return self.max() if callable(self.max) else self.max
+
+    def GetInc(self):
+        return self.inc
+
+    def GetAccessMode(self) -> int:
+        return genicam.RO if self.getter is not None else genicam.RW
+
+    def GetValue(self):
+        if self.getter is not None:
+            return self.getter()
+        return self.value
+
+    def SetValue(self, value):
+        if self.getter is not None:
+            raise genicam.AccessException("Node is not writable", __file__, 0)
+
+        if self.entries is not None:
+            if value not in self.entries:
+                raise genicam.InvalidArgumentException(
+                    f"{value} is not a valid entry", __file__, 0
+                )
+        elif self.min is not None or self.max is not None:
+            maximum = self.GetMax()
+            if (self.min is not None and value < self.min) or (
+                maximum is not None and value > maximum
+            ):
+                raise genicam.OutOfRangeException(
+                    f"{value} must be within [{self.min}, {maximum}]", __file__, 0
+                )
+            if self.inc and (value - (self.min or 0)) % self.inc:
+                raise genicam.OutOfRangeException(
+                    f"{value} must be a multiple of {self.inc}", __file__, 0
+                )
+            if isinstance(self.value, int):
+                value = int(value)
+
+        self.value = value
+
+
+class HeightNode(Node):
+    """Frame height, which is the sum of the zone heights with ROI zones on"""
+
+    def __init__(self, camera, **kwargs):
+        super().__init__(**kwargs)
+        self.camera = camera
+
+    def GetValue(self):
+        return self.camera.zone_rows().size
+
+
+class SelectedNode:
+    """Node whose value depends on a selector node, e.g. per ROI zone"""
+
+    def __init__(self, selector: Node, nodes: dict):
+        self.selector = selector
+        self.nodes = nodes
+
+    def __getattr__(self, name: str):
+        return getattr(self.nodes[self.selector.GetValue()], name)
+
+
+class CommandNode:
+    """GenICam command node"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def Execute(self):
+        self.callback()
+
+
+class GrabResult:
+    """Grab result with the pylon attributes used by the acquisition code"""
+
+    def __init__(
+        self,
+        array: ndarray = None,
+        block_id: int = 0,
+        timestamp: int = 0,
+        error_code: int = 0,
+        error_description: str = "",
+    ):
+        self.Array = array
+        self.BlockID = block_id
+        self.TimeStamp = timestamp
+        self.ErrorCode = error_code
+        self.ErrorDescription = error_description
+
+    def GrabSucceeded(self) -> bool:
+        return self.Array is not None and not self.ErrorCode
+
+    def IsValid(self) -> bool:
+        return self.Array is not None or bool(self.ErrorCode)
+
+    def GetArray(self) -> ndarray:
+        return self.Array
+
+    def Release(self):
+        self.Array = None
+
+
+class SimulatedCamera:
+    """Simulated ACA2040 with the pylon InstantCamera interface
+
+    Frames are cut from a scene that moves rows_per_frame rows per frame
+    past the sensor, as in an encoder-triggered scan, or replayed cyclically from
+    recorded frames. Each ROI zone therefore sees the scene displaced by
+    its zone offset.
+
+    Frames are generated at fps when free running or line triggered (the
+    encoder pulses), and on TriggerSoftware.Execute() with a software
+    trigger. fps=None delivers frames as fast as they are
+    retrieved. Frames arriving while all MaxNumBuffer buffers are queued
+    are lost, which shows up as a BlockID gap as on the camera.
+
+    drop_rate       Fraction of frames lost in transport (BlockID gaps)
+    fail_rate       Fraction of frames delivered as failed grabs
+    stall_after     Stop triggering after this many frames, so the next
+                    retrieve times out
+    rows_per_frame  Scan lines the stage advances between triggers
+    """
+
+    # pylon error code of an incomplete frame
+    ERROR_INCOMPLETE = 0xE1000014
+
+    def __init__(
+        self,
+        fps: float = 635,
+        scene: ndarray = None,
+        frames: ndarray = None,
+        drop_rate: float = 0.0,
+        fail_rate: float = 0.0,
+        stall_after: int = None,
+        rows_per_frame: int = 1,
+        seed: int = 0,
+    ):
+        self.sensor_width_pix = 2064
+        self.sensor_height_pix = 1544
+
+        self.fps = fps
+        self.drop_rate = drop_rate
+        self.fail_rate = fail_rate
+        self.stall_after = stall_after
+        self.rows_per_frame = rows_per_frame
+        self.rng = np.random.default_rng(seed)
+
+        if frames is not None:
+            self.frames = frames
+            self.scene = None
+        else:
+            if scene is None:
+                # 12-bit noise is a worst case for compression and an easy
+                # target for registration
+                scene = self.rng.integers(
+                    0, 4096, (4096, self.sensor_width_pix), dtype=np.uint16
+                )
+            self.frames = None
+            self.scene = scene
+
+        self._init_nodes()
+
+        self._open = False
+        self._grabbing = False
+        self._max_results = None
+        self._results = 0
+
+        # trigger bookkeeping, guarded by the condition
+        self._cond = threading.Condition()
+        self._t_start = 0.0
+        self._triggered = 0
+        self._seen = 0
+        self._queue = []
+
+    def _init_nodes(self):
+        width, height = self.sensor_width_pix, self.sensor_height_pix
+
+        # ROI zones (the ACA2040 supports 8 zones of at least 4 rows)
+        self.ROIZoneSelector = Node(
+            "Zone0", entries=tuple(f"Zone{i}" for i in range(8))
+        )
+        zones = self.ROIZoneSelector.entries
+        self.ROIZoneMode = SelectedNode(
+            self.ROIZoneSelector, {z: Node("Off", entries=("On", "Off")) for z in zones}
+        )
+        self.ROIZoneOffset = SelectedNode(
+            self.ROIZoneSelector,
+            {z: Node(0, min=0, max=height - 4, inc=4) for z in zones},
+        )
+        self.ROIZoneSize = SelectedNode(
+            self.ROIZoneSelector,
+            {z: Node(4, min=4, max=height, inc=4) for z in zones},
+        )
+
+        self.Width = Node(width, min=16, max=width, inc=8)
+        self.OffsetX = Node(0, min=0, max=width - 16, inc=8)
+        # the readout window has to stay on the sensor
+        self.Height = HeightNode(
+            self, value=height, min=1, max=lambda: height - self.OffsetY.value, inc=1
+        )
+        self.OffsetY = Node(0, min=0, max=lambda: height - self.Height.value, inc=1)
+
+        self.MaxNumBuffer = Node(10, min=1, max=1024)
+        self.AcquisitionMode = Node("Continuous", entries=("Continuous", "SingleFrame"))
+        self.PixelFormat = Node("Mono12p", entries=("Mono8", "Mono12", "Mono12p"))
+        self.ExposureTime = Node(100.0, min=10.0, max=1e7)
+        self.ResultingFrameRate = Node(
+            getter=lambda: self.fps or 1e6 / self.ExposureTime.GetValue()
+        )
+
+        self.TriggerSelector = Node(
+            "FrameStart", entries=("FrameStart", "FrameBurstStart")
+        )
+        self.TriggerMode = Node("Off", entries=("On", "Off"))
+        self.TriggerSource = Node(
+            "Line1", entries=("Line1", "Line3", "Line4", "Software")
+        )
+        self.TriggerActivation = Node(
+            "RisingEdge", entries=("RisingEdge", "FallingEdge")
+        )
+        self.TriggerSoftware = CommandNode(self.trigger)
+
+        self.LineSelector = Node(
+            "Line1", entries=tuple(f"Line{i}" for i in range(1, 5))
+        )
+        lines = self.LineSelector.entries
+        self.LineMode = SelectedNode(
+            self.LineSelector,
+            {
+                line: Node(mode, entries=("Input", "Output"))
+                for line, mode in zip(lines, ("Input", "Output", "Input", "Input"))
+            },
+        )
+        self.LineSource = SelectedNode(
+            self.LineSelector, {line: Node("ExposureActive") for line in lines}
+        )
+        self.LineInverter = SelectedNode(
+            self.LineSelector, {line: Node(False) for line in lines}
+        )
+        self.LineDebouncerTime = SelectedNode(
+            self.LineSelector, {line: Node(0.0, min=0.0, max=2e4) for line in lines}
+        )
+        self.LineMinimumOutputPulseWidth = SelectedNode(
+            self.LineSelector, {line: Node(0.0, min=0.0, max=1e5) for line in lines}
+        )
+
+        self.DeviceTemperatureSelector = Node("Coreboard", entries=("Coreboard",))
+        self.DeviceTemperature = Node(getter=lambda: 40.0)
+        self.TemperatureState = Node(getter=lambda: "Ok")
+
+    def __setattr__(self, name: str, value):
+        # pylon allows assigning parameter values directly, e.g.
+        # cam.MaxNumBuffer = 5
+        node = self.__dict__.get(name)
+        if isinstance(node, (Node, SelectedNode)) and not isinstance(
+            value, (Node, SelectedNode)
+        ):
+            node.SetValue(value)
+        else:
+            super().__setattr__(name, value)
+
+    # --------------------- #
+    #    Image geometry     #
+    # --------------------- #
+
+    def zone_rows(self) -> ndarray:
+        """Return the sensor rows read out in each frame"""
+        zones = [
+            z
+            for z in self.ROIZoneSelector.entries
+            if self.ROIZoneMode.nodes[z].GetValue() == "On"
+        ]
+
+        if not zones:
+            offset = self.OffsetY.GetValue()
+            return np.arange(offset, offset + self.Height.value)
+
+        return np.concatenate(
+            [
+                np.arange(
+                    self.ROIZoneOffset.nodes[z].GetValue(),
+                    self.ROIZoneOffset.nodes[z].GetValue()
+                    + self.ROIZoneSize.nodes[z].GetValue(),
+                )
+                for z in zones
+            ]
+        )
+
+    def render(self, block_id: int) -> ndarray:
+        """Return the image of a frame"""
+        rows = self.zone_rows()
+        offset_x, width = self.OffsetX.GetValue(), self.Width.GetValue()
+
+        if self.frames is not None:
+            frame = self.frames[block_id % self.frames.shape[0]]
+            return np.ascontiguousarray(frame[: rows.size, offset_x : offset_x + width])
+
+        scene = self.scene
+        cols = np.arange(offset_x, offset_x + width) % scene.shape[1]
+        return scene[
+            np.ix_((rows + block_id * self.rows_per_frame) % scene.shape[0], cols)
+        ]
+
+    # --------------------- #
+    #    Device interface   #
+    # --------------------- #
+
+    def Open(self):
+        self._open = True
+
+    def Close(self):
+        self.StopGrabbing()
+        self._open = False
+
+    def IsOpen(self) -> bool:
+        return self._open
+
+    def StartGrabbing(self, strategy: int = pylon.GrabStrategy_OneByOne):
+        self.StartGrabbingMax(None, strategy)
+
+    def StartGrabbingMax(
+        self, max_images: int, strategy: int = pylon.GrabStrategy_OneByOne
+    ):
+        with self._cond:
+            self._grabbing = True
+            self._max_results = max_images
+            self._results = 0
+            self._t_start = time.perf_counter()
+            self._triggered = 0
+            self._seen = 0
+            self._queue = []
+
+    def StopGrabbing(self):
+        with self._cond:
+            self._grabbing = False
+            self._cond.notify_all()
+
+    def IsGrabbing(self) -> bool:
+        return self._grabbing
+
+    def trigger(self):
+        """Fire one software trigger"""
+        with self._cond:
+            self._triggered += 1
+            self._cond.notify_all()
+
+    def _software_triggered(self) -> bool:
+        return (
+            self.TriggerMode.GetValue() == "On"
+            and self.TriggerSource.GetValue() == "Software"
+        )
+
+    def _clocked(self) -> bool:
+        return self.fps is not None and not self._software_triggered()
+
+    def _update(self, now: float):
+        """Queue frames triggered since the last call"""
+        if self._clocked():
+            self._triggered = int((now - self._t_start) * self.fps)
+            self._queue_frames()
+        elif self._software_triggered():
+            self._queue_frames()
+        else:
+            # unthrottled: a frame is ready whenever one is requested
+            while not self._queue and not self._stalled():
+                self._triggered = self._seen + 1
+                self._queue_frames()
+
+    def _stalled(self) -> bool:
+        return self.stall_after is not None and self._seen >= self.stall_after
+
+    def _queue_frames(self):
+        triggered = self._triggered
+        if self.stall_after is not None:
+            triggered = min(triggered, self.stall_after)
+
+        # frames that find no free buffer are lost
+        num_buffers = self.MaxNumBuffer.GetValue()
+        for block_id in range(self._seen, triggered):
+            if len(self._queue) < num_buffers and self.rng.random() >= self.drop_rate:
+                self._queue.append(block_id)
+        self._seen = max(self._seen, triggered)
+
+    def _next_due(self) -> float:
+        if self._clocked():
+            return self._t_start + (self._seen + 1) / self.fps
+        return float("inf")
+
+    def RetrieveResult(
+        self, timeout: int, handling: int = pylon.TimeoutHandling_ThrowException
+    ) -> GrabResult:
+        """Wait up to timeout ms for the next queued frame"""
+        deadline = time.perf_counter() + timeout / 1e3
+
+        with self._cond:
+            while True:
+                now = time.perf_counter()
+                self._update(now)
+
+                if self._queue or not self._grabbing or now >= deadline:
+                    break
+
+                wait = min(self._next_due(), deadline) - now
+                self._cond.wait(max(wait, 0))
+
+            if not self._queue:
+                if handling == pylon.TimeoutHandling_ThrowException:
+                    raise genicam.TimeoutException(
+                        f"Grab timed out after {timeout} ms", __file__, 0
+                    )
+                return GrabResult()
+
+            block_id = self._queue.pop(0)
+
+            self._results += 1
+            if self._max_results is not None and self._results >= self._max_results:
+                self._grabbing = False
+
+        # camera timestamps count nanoseconds
+        timestamp = int((block_id + 1) / (self.fps or 1e6) * 1e9)
+
+        if self.rng.random() < self.fail_rate:
+            return GrabResult(
+                block_id=block_id,
+                timestamp=timestamp,
+                error_code=self.ERROR_INCOMPLETE,
+                error_description="The buffer was incompletely grabbed",
+            )
+
+        return GrabResult(self.render(block_id), block_id, timestamp)
+
+    def GrabOne(self, timeout: int) -> GrabResult:
+        """Grab a single frame"""
+        self.StartGrabbingMax(1)
+        try:
+            return self.RetrieveResult(timeout)
+        finally:
+            self.StopGrabbing()
@@ -0,0 +1,194 @@
+# ===============================================================================
+#    Stream reconstruction rows to disk during long acquisitions
+# ===============================================================================
+
+import json
+import queue
+import threading
+import numpy as np
+import tifffile as tf
+
+from numpy import ndarray
+
+
+class RowWriter(threading.Thread):
+    """Append reconstruction rows to a memory-mapped .npy file
+
+    Row blocks are handed over through a bounded queue, so the acquisition
+    blocks instead of growing memory if the disk falls behind. The number
+    of valid rows is flushed to a JSON sidecar as blocks are written, which
+    keeps everything acquired before an interruption readable. A failed
+    write stops the writer and is raised from the next put
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        num_zones: int,
+        total_rows: int,
+        width: int,
+        max_queue: int = 16,
+        flush_rows: int = 4096,
+    ):
+        super().__init__(daemon=True)
+        self.fname = fname
+        self.flush_rows = flush_rows
+
+        self.arr = np.lib.format.open_memmap(
+            fname, mode="w+", dtype=np.uint16, shape=(num_zones, total_rows, width)
+        )
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self.rows_written = 0
+        self.error = None
+        self._rows_flushed = 0
+        self._write_progress()
+
+    def put(self, start: int, block: ndarray):
+        """Queue a (num_zones, rows, width) block starting at row start
+
+        Blocks while the queue is full
+        """
+        # nothing drains the queue once the writer has stopped
+        while True:
+            self.check()
+            try:
+                self.queue.put((start, block), timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def check(self):
+        """Raise if the writer has stopped on an error"""
+        if self.error is not None:
+            raise RuntimeError(f"Stream writer stopped: {self.error}") from self.error
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+
+                start, block = item
+                stop = start + block.shape[1]
+                self.arr[:, start:stop] = block
+                self.rows_written = max(self.rows_written, stop)
+
+                if self.rows_written - self._rows_flushed >= self.flush_rows:
+                    self.flush()
+        except Exception as e:
+            self.error = e
+            print(f"Stream writer stopped: {e}")
+        finally:
+            self.flush()
+
+    def flush(self):
+        """Write pending rows to disk and record progress"""
+        self.arr.flush()
+        self._rows_flushed = self.rows_written
+        self._write_progress()
+
+    def close(self):
+        """Write all queued blocks and release the file"""
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+        self.join()
+        del self.arr
+
+    def _write_progress(self):
+        with open(self.fname + ".json", "w") as file:
+            file.write(
+                json.dumps(
+                    {"shape": list(self.arr.shape), "rows_written": self.rows_written},
+                    indent=4,
+                )
+            )
+
+
+class StackWriter(threading.Thread):
+    """Write the slices of a preallocated stack to one multi-page TIFF
+
+    The acquisition fills stack slices in order and hands over their index,
+    and pages are written from this thread as they arrive, so grabbing
+    never waits on disk I/O. Pages are stored uncompressed with the full
+    16-bit data. Slices that were never filled are written as zeros when
+    the writer is closed, so the file always holds the full stack. A failed
+    write stops the writer and is raised from the next put
+    """
+
+    def __init__(self, fname: str, stack: ndarray, description: dict = None):
+        super().__init__(daemon=True)
+        self.fname = fname
+        self.stack = stack
+        self.description = description
+
+        self.queue = queue.Queue()
+
+        self.slices_written = 0
+        self.error = None
+        self._filled = 0
+
+    def put(self, index: int):
+        """Mark stack slices up to and including index as filled"""
+        self.check()
+        self.queue.put(index)
+
+    def check(self):
+        """Raise if the writer has stopped on an error"""
+        if self.error is not None:
+            raise RuntimeError(f"Stack writer stopped: {self.error}") from self.error
+
+    def _pages(self):
+        for i in range(self.stack.shape[0]):
+            while self._filled is not None and self._filled <= i:
+                index = self.queue.get()
+                self._filled = None if index is None else index + 1
+
+            yield self.stack[i]
+
+            if self._filled is not None:
+                self.slices_written = i + 1
+
+    def run(self):
+        # ImageJ hyperstacks are limited to 4 GB
+        bigtiff = self.stack.nbytes > 2**32 - 2**25
+
+        metadata = {"axes": "ZYX"}
+        if self.description is not None:
+            metadata["Info"] = json.dumps(self.description)
+
+        try:
+            with tf.TiffWriter(self.fname, bigtiff=bigtiff, imagej=not bigtiff) as tif:
+                tif.write(
+                    self._pages(),
+                    shape=self.stack.shape,
+                    dtype=self.stack.dtype,
+                    photometric="minisblack",
+                    metadata=metadata,
+                )
+        except Exception as e:
+            self.error = e
+            print(f"Stack writer stopped: {e}")
+
+    def close(self):
+        """Write the remaining slices and close the file"""
+        self.queue.put(None)
+        self.join()
+
+
+def read_stream(fname: str) -> ndarray:
+    """Open a streamed acquisition as a read-only memory-mapped array
+
+    Only the rows recorded in the progress file are returned
+    """
+    with open(fname + ".json") as file:
+        progress = json.loads(file.read())
+
+    arr = np.load(fname, mmap_mode="r")
+    return arr[:, : progress["rows_written"]]
@@ -0,0 +1,269 @@
+# ===============================================================================
+#    Benchmark processing and acquisition hot paths on synthetic zone stacks
+#
+#    Runs without hardware, the camera is replaced by the simulator. Results
+#    are saved as JSON in scripts/benchmarks and compared with the last run
+# ===============================================================================
+
+import os
+import io
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import processing.alignment as alignment
+import processing.artifacts as artifacts
+import processing.calibration as calibration
+import processing.export as export
+
+from numpy import ndarray
+from scipy import ndimage
+from datetime import datetime
+from basler.baslerace import ACA2040
+from basler.simulator import SimulatedCamera
+from processing.registration import register, row_shift, col_shift
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmarks")
+
+# (planes, rows) per stack
+SIZES = [(2, 8000), (5, 8000), (7, 8000)]
+
+
+def synthetic_stack(
+    num_planes: int,
+    total_rows: int,
+    width: int = 2064,
+    shift: int = 3,
+    seed: int = 0,
+) -> ndarray:
+    """Return a 12-bit zone stack resembling an acquisition
+
+    Every plane images the same smooth scene, offset by shift rows per
+    plane like neighbouring zones, with a column gain pattern and shot
+    noise on top
+    """
+    rng = np.random.default_rng(seed)
+
+    scene = rng.random((total_rows + num_planes * shift, width), dtype=np.float32)
+    scene = ndimage.uniform_filter(scene, 9)
+    scene -= scene.min()
+    scene *= 3000 / scene.max()
+    scene += 500
+
+    cols = np.arange(width, dtype=np.float32)
+    stack = np.empty((num_planes, total_rows, width), dtype=np.uint16)
+    for p in range(num_planes):
+        gain = 1 + 0.05 * np.sin(cols / (40 + 10 * p))
+        plane = scene[p * shift : p * shift + total_rows] * gain
+        plane += rng.normal(0, 20, plane.shape).astype(np.float32)
+        stack[p] = np.clip(plane, 0, 4095)
+
+    return stack
+
+
+@contextlib.contextmanager
+def synthetic_calibration(num_planes: int, width: int, shift: int = 3):
+    """Serve calibration tables that match synthetic_stack
+
+    The lab calibration files only cover the plane counts in use, at the
+    full sensor width. Alignment offsets undo the plane shift and the
+    filter values follow the column gain pattern of synthetic_stack
+    """
+    planes = np.arange(num_planes)
+    cols = np.arange(width, dtype=np.float32)
+
+    tables = {
+        "align_data_tilt.json": {
+            num_planes: {
+                "rows": ((num_planes - 1 - 2 * planes) * shift).tolist(),
+                "cols": [0] * num_planes,
+            }
+        },
+        "artifact_data_tilt.json": {
+            num_planes: [
+                (1 + 0.05 * np.sin(cols / (40 + 10 * p))).tolist() for p in planes
+            ]
+        },
+    }
+
+    store = calibration.store
+    with tempfile.TemporaryDirectory() as cal_dir:
+        for fname, data in tables.items():
+            with open(os.path.join(cal_dir, fname), "w") as file:
+                file.write(json.dumps(data))
+
+        calibration.store = calibration.CalibrationStore(cal_dir)
+        try:
+            yield
+        finally:
+            calibration.store = store
+
+
+def measure(func, *args, repeats: int = 3) -> dict:
+    """Time a call and trace its peak memory
+
+    Timed runs are untraced. Peak memory is taken from one extra run under
+    tracemalloc, which sees numpy allocations but not buffers allocated
+    inside compiled libraries
+    """
+    times = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t_start)
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "best_s": min(times),
+        "median_s": float(np.median(times)),
+        "peak_mb": peak / 1e6,
+    }
+
+
+def quiet(func):
+    """Wrap a function that prints per-plane progress"""
+
+    def run(*args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+
+    return run
+
+
+def open_camera(num_planes: int, width: int) -> ACA2040:
+    """Open a simulated camera configured for zone stacks"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        cam = ACA2040(frame_width_pix=width, device=SimulatedCamera(fps=None))
+        cam.set_roi_zones(num_planes)
+    return cam
+
+
+def run_benchmarks(
+    num_planes: int, total_rows: int, width: int = 2064, repeats: int = 3
+) -> dict:
+    """Measure every stage of the pipeline for one stack size"""
+    with synthetic_calibration(num_planes, width):
+        return _run_benchmarks(num_planes, total_rows, width, repeats)
+
+
+def _run_benchmarks(num_planes: int, total_rows: int, width: int, repeats: int) -> dict:
+    cam = open_camera(num_planes, width)
+
+    # raw stacks include the rows cropped from the zone overlap
+    raw = synthetic_stack(num_planes, total_rows + cam.height_max, width)
+    img = cam.crop_overlap_zone(raw)
+    img_proc = artifacts.filter_col_artifacts(img)
+
+    results = {}
+    stages = {
+        "acquire_stack (simulated)": (
+            quiet(cam.acquire_stack),
+            num_planes,
+            total_rows,
+            width,
+        ),
+        "crop_overlap_zone": (cam.crop_overlap_zone, raw),
+        "filter_col_artifacts": (artifacts.filter_col_artifacts, img),
+        "align": (alignment.align, img_proc),
+        "row_shift": (quiet(row_shift), img),
+        "col_shift": (quiet(col_shift), img),
+        "register": (quiet(register), img),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stages["write_reconstruction"] = (
+            export.write_reconstruction,
+            os.path.join(tmp, "stack.ome.tif"),
+            img_proc,
+        )
+        stages["save_image_array"] = (
+            ACA2040.save_image_array,
+            img_proc,
+            os.path.join(tmp, "stack.tif"),
+        )
+
+        for name, (func, *args) in stages.items():
+            results[name] = measure(func, *args, repeats=repeats)
+            print(
+                f"{name:>28}: {results[name]['best_s']:8.3f} s "
+                f"{results[name]['peak_mb']:9.1f} MB"
+            )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cam.close()
+
+    return results
+
+
+def last_results(results_dir: str = RESULTS_DIR) -> dict:
+    """Return the most recent saved run, None if there is none"""
+    if not os.path.isdir(results_dir):
+        return None
+
+    fnames = sorted(f for f in os.listdir(results_dir) if f.endswith(".json"))
+    if not fnames:
+        return None
+
+    with open(os.path.join(results_dir, fnames[-1])) as file:
+        return json.loads(file.read())
+
+
+def compare(previous: dict, current: dict):
+    """Print the change in time and peak memory of every stage"""
+    print(f"\nCompared with run of {previous['timestamp']}:")
+
+    for size, stages in current["results"].items():
+        if size not in previous["results"]:
+            continue
+
+        print(size)
+        for name, now in stages.items():
+            before = previous["results"][size].get(name)
+            if before is None:
+                continue
+
+            print(
+                f"{name:>28}: {now['best_s'] / before['best_s']:6.2f}x time, "
+                f"{now['peak_mb'] - before['peak_mb']:+9.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    width = 2064
+    repeats = 3
+
+    previous = last_results()
+
+    run = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+        "system": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "repeats": repeats,
+        "results": {},
+    }
+
+    for num_planes, total_rows in SIZES:
+        size = f"{num_planes}x{total_rows}x{width}"
+        print(size)
+        run["results"][size] = run_benchmarks(num_planes, total_rows, width, repeats)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, run["timestamp"] + ".json"), "w") as file:
+        file.write(json.dumps(run, indent=4))
+
+    if previous is not None:
+        compare(previous, run)
@@ -3,144 +3,14 @@
 #    Requires grid target
 # ===============================================================================
 
-import math
 import json
 import warnings
-import numpy as np
 
 from numpy import ndarray
+from concurrent.futures import ProcessPoolExecutor
 from asi.asistage import MS2000
-from basler.baslerace import ACA2040
-from matplotlib import pyplot as plt
-
-
-def row_shift(arr: ndarray, plot: bool = False) -> ndarray:
-    arr = arr.astype(np.float64)
-    rows = np.zeros((arr.shape[0],), dtype=np.int16)
-
-    for i in range(int(arr.shape[0] / 2)):
-        # subtract corresponding image slices for reference
-        subtraction = arr[i] - arr[-i - 1]
-
-        err_baseline = np.sqrt(np.sum(np.square(subtraction)))
-
-        # shift images by a fraction of original shape
-        # shift_y = math.trunc(arr.shape[1] / 20)
-        shift_y = 200
-
-        err_y_down = np.empty((shift_y), dtype=np.float64)
-        err_y_up = np.empty((shift_y), dtype=np.float64)
-
-        err_y_down[0] = err_baseline
-        err_y_up[0] = err_baseline
-
-        # y-axis shift-down
-        for r in range(1, shift_y):
-            # subtract pixel values from first and last slices
-            sub = arr[i][:-r] - arr[-i - 1][r:]
-            err_y_down[r] = np.sqrt(np.sum(np.square(sub)))
-
-        # y-axis shift-up
-        for r in range(1, shift_y):
-            # subtract pixel values from first and last slices
-            sub = arr[i][r:] - arr[-i - 1][:-r]
-            err_y_up[r] = np.sqrt(np.sum(np.square(sub)))
-
-        vertex_down = np.amin(err_y_down)
-        vertex_up = np.amin(err_y_up)
-
-        if vertex_down < vertex_up:
-            err_factor_y = np.where(err_y_down == vertex_down)[0][0]
-            if err_factor_y > 0:
-                rows[i] = -err_factor_y
-                rows[-i - 1] = err_factor_y
-            print(
-                f"Remove {err_factor_y} rows from the bottom of plane {i} and "
-                f"top of plane {len(arr) -i -1}"
-            )
-        else:
-            err_factor_y = np.where(err_y_up == vertex_up)[0][0]
-            if err_factor_y > 0:
-                rows[i] = err_factor_y
-                rows[-i - 1] = -err_factor_y
-            print(
-                f"Remove {err_factor_y} rows from the top of plane {i} and "
-                f"bottom of plane {len(arr) -i -1}"
-            )
-
-    if plot:
-        err_y = np.append(np.flip(err_y_down), err_y_up[1:])
-
-        fig = plt.figure()
-        ax = fig.add_axes([0, 0, 1, 1])
-        ax.plot(np.linspace(-shift_y, shift_y - 1, num=shift_y * 2 - 1), err_y)
-        fig.savefig("error_y.jpg", bbox_inches="tight")
-
-    return rows
-
-
-def col_shift(arr: ndarray, plot: bool = False) -> ndarray:
-    arr = arr.astype(np.float64)
-    cols = np.zeros((arr.shape[0],), dtype=int)
-
-    for i in range(int(arr.shape[0] / 2)):
-        # subtract corresponding image slices for reference
-        subtraction = arr[i] - arr[-i - 1]
-
-        err_baseline = np.sqrt(np.sum(np.square(subtraction)))
-
-        # shift_x = math.trunc(arr.shape[2] / 10)
-        shift_x = 20
-
-        err_x_left = np.empty((shift_x), dtype=np.float64)
-        err_x_right = np.empty((shift_x), dtype=np.float64)
-
-        err_x_left[0] = err_baseline
-        err_x_right[0] = err_baseline
-
-        # x-axis shift-right
-        for c in range(1, shift_x):
-            # subtract pixel values from first and last slices
-            sub = arr[i][:, c:] - arr[-i - 1][:, :-c]
-            err_x_right[c] = np.sqrt(np.sum(np.square(sub)))
-
-        # x-axis shift-left
-        for c in range(1, shift_x):
-            # subtract pixel values from first and last slices
-            sub = arr[i][:, :-c] - arr[-i - 1][:, c:]
-            err_x_left[c] = np.sqrt(np.sum(np.square(sub)))
-
-        vertex_right = np.amin(err_x_right)
-        vertex_left = np.amin(err_x_left)
-
-        if vertex_right < vertex_left:
-            err_factor_x = np.where(err_x_right == vertex_right)[0][0]
-            if err_factor_x > 0:
-                cols[i] = err_factor_x
-                cols[-i - 1] = -err_factor_x
-            print(
-                f"Remove {err_factor_x} cols from the left of plane {i} and "
-                f"right of plane {len(arr) -i -1}"
-            )
-        else:
-            err_factor_x = np.where(err_x_left == vertex_left)[0][0]
-            if err_factor_x > 0:
-                cols[i] = -err_factor_x
-                cols[-i - 1] = err_factor_x
-            print(
-                f"Remove {err_factor_x} cols from the right of plane {i} and "
-                f"left of plane {len(arr) -i -1}"
-            )
-
-    if plot:
-        err_x = np.append(np.flip(err_x_right), err_x_left[1:])
-
-        fig = plt.figure()
-        ax = fig.add_axes([0, 0, 1, 1])
-        ax.plot(np.linspace(-shift_x, shift_x - 1, num=shift_x * 2 - 1), err_x)
-        fig.savefig("error_x.jpg", bbox_inches="tight")
-
-    return cols
+from basler.session import CameraSession
+from processing.registration import register, row_shift, col_shift
 
 
 def scan(
@@ -169,6 +39,15 @@ def scan(
     stage.scan_x_axis_enc(start=start, num_pix=num_pix, enc_divide=enc_divide)
 
 
+def shift_values(img: ndarray, subpixel: bool) -> dict:
+    """Return row and column shifts of a stack, runs in a worker process"""
+    if subpixel:
+        rows, cols = register(img)
+    else:
+        rows, cols = row_shift(img), col_shift(img)
+    return {"rows": rows.tolist(), "cols": cols.tolist()}
+
+
 if __name__ == "__main__":
     stage = MS2000("COM3", 115200)
 
@@ -179,6 +58,7 @@ if __name__ == "__main__":
 
     mid_point = (0, 0)  # scan mid-point
     scan_range_factor = 2  # number of overlapping fovs
+    subpixel = False  # joint row/col search with sub-pixel offsets
 
     confirm = input(
         """This process will overwrite the current alignment data. """
@@ -187,39 +67,42 @@ if __name__ == "__main__":
     )
 
     if confirm == "y":
-        vals = {"2": {}, "3": {}, "4": {}, "5": {}, "6": {}, "7": {}}
-
-        for z in range(2, 8):
-            cam = ACA2040(exposure_time_us=30)
-
-            # configure camera triggers and IO
-            cam.set_trigger()
-            cam.set_io_control(line=2, source="ExposureActive")
-
-            cam.set_roi_zones(z)
-
-            scan_range = scan_range_factor * cam.fov_height_mm
-            total_row_acq = cam.sensor_height_pix * (scan_range_factor + 1)
-            stage_vel = "{:.4f}".format(cam.sensor_pix_size_mm * cam.fps_max / 2)
-
-            # initiate scan and data acquisition
-            scan(
-                stage,
-                stage_vel,
-                mid_point,
-                scan_range,
-                cam.fov_height_mm,
-                cam.sensor_pix_size_mm * 1e5,
-                total_row_acq,
-            )
-            img = cam.acquire_stack(z, total_row_acq)
-            cam.close()
-
-            vals[str(z)]["rows"] = row_shift(img).tolist()
-            vals[str(z)]["cols"] = col_shift(img).tolist()
-
-            # wait in case stage is still moving to start position
-            stage.wait_for_device()
+        futures = {}
+
+        # keep the camera open and only rewrite settings that change, and
+        # compute the shifts of each stack while the next one is acquired
+        with CameraSession(exposure_time_us=30) as cam, ProcessPoolExecutor(
+            max_workers=2
+        ) as pool:
+            for z in range(2, 8):
+                # configure camera triggers and IO
+                cam.set_trigger()
+                cam.set_io_control(line=2, source="ExposureActive")
+
+                cam.set_roi_zones(z)
+
+                scan_range = scan_range_factor * cam.fov_height_mm
+                total_row_acq = cam.sensor_height_pix * (scan_range_factor + 1)
+                stage_vel = "{:.4f}".format(cam.sensor_pix_size_mm * cam.fps_max / 2)
+
+                # initiate scan and data acquisition
+                scan(
+                    stage,
+                    stage_vel,
+                    mid_point,
+                    scan_range,
+                    cam.fov_height_mm,
+                    cam.sensor_pix_size_mm * 1e5,
+                    total_row_acq,
+                )
+                img = cam.acquire_stack(z, total_row_acq)
+
+                futures[str(z)] = pool.submit(shift_values, img, subpixel)
+
+                # wait in case stage is still moving to start position
+                stage.wait_for_device()
+
+        vals = {z: future.result() for z, future in futures.items()}
 
         # save filtering values
         with open("./scripts/processing/align_data_flat.json", "w") as file:
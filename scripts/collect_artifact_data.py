@@ -7,6 +7,7 @@ import warnings
 import numpy as np
 
 from numpy import ndarray
+from concurrent.futures import ProcessPoolExecutor
 from asi.asistage import MS2000
 from basler.baslerace import ACA2040
 
@@ -38,6 +39,7 @@ def scan(
 
 
 def calc_col_filter(img_arr: ndarray) -> ndarray:
+    """Average each plane over rows, runs in a worker process"""
     col_filter_vals = np.empty((img_arr.shape[0], img_arr.shape[2]), dtype=np.float64)
 
     for i in range(img_arr.shape[0]):
@@ -75,29 +77,32 @@ if __name__ == "__main__":
     )
 
     if confirm == "y":
-        vals = {}
-
-        for z in range(2, 8):
-            cam.set_roi_zones(z)
-
-            # initiate scan and data acquisition
-            scan(
-                stage,
-                stage_vel,
-                mid_point,
-                scan_range,
-                cam.fov_height_mm,
-                cam.sensor_pix_size_mm * 1e5,
-                total_row_acq,
-            )
-            img = cam.acquire_stack(z, total_row_acq)
-
-            col_filter_vals = calc_col_filter(img)
-
-            # wait in case stage is still moving to start position
-            stage.wait_for_device()
-
-            vals[str(z)] = col_filter_vals.tolist()
+        futures = {}
+
+        # filter values of each stack are computed while the next one is
+        # acquired
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            for z in range(2, 8):
+                cam.set_roi_zones(z)
+
+                # initiate scan and data acquisition
+                scan(
+                    stage,
+                    stage_vel,
+                    mid_point,
+                    scan_range,
+                    cam.fov_height_mm,
+                    cam.sensor_pix_size_mm * 1e5,
+                    total_row_acq,
+                )
+                img = cam.acquire_stack(z, total_row_acq)
+
+                futures[str(z)] = pool.submit(calc_col_filter, img)
+
+                # wait in case stage is still moving to start position
+                stage.wait_for_device()
+
+        vals = {z: future.result().tolist() for z, future in futures.items()}
 
         # save filtering values
         with open("./scripts/processing/artifact_data_tilt.json", "w") as file:
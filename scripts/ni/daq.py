@@ -3,17 +3,48 @@
 # ===============================================================================
 
 
+import time
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
 
 from nidaqmx import Task
 from nidaqmx.stream_readers import CounterReader
 from nidaqmx.constants import AcquisitionType, CountDirection, Edge
+from numpy import ndarray
+
+
+class TickStats:
+    """Frame counters per encoder tick, updated as samples stream in
+
+    ticks       Encoder ticks sampled
+    skipped     Ticks without a camera exposure
+    extra       Exposures beyond one per tick
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.skipped = 0
+        self.extra = 0
+
+    def __str__(self):
+        return f"ticks: {self.ticks}, skipped: {self.skipped}, extra: {self.extra}"
 
 
 class DAQ:
-    def __init__(self, total_ticks: int):
+    """Count camera exposures (PFI0) at every stage encoder tick (PFI1)
+
+    Samples are streamed in blocks of every_n from an every-N-samples
+    callback into a preallocated ring, and skipped-frame statistics are
+    kept up to date as they arrive. Sample i holds the number of frames
+    exposed up to tick i, which places each camera frame on the stage
+    encoder timeline
+    """
+
+    def __init__(self, total_ticks: int, every_n: int = 1000, capacity: int = None):
         self.total_ticks = total_ticks
+        self.every_n = every_n
+        self.capacity = capacity or total_ticks
 
         self.ci_task = Task()
 
@@ -26,46 +57,160 @@ class DAQ:
 
         self.channel.ci_count_edges_term = "PFI0"
 
+        # continuous, so the callback keeps draining the device buffer
         self.ci_task.timing.cfg_samp_clk_timing(
             rate=50000,
             source="PFI1",
             active_edge=Edge.RISING,
-            sample_mode=AcquisitionType.FINITE,
+            sample_mode=AcquisitionType.CONTINUOUS,
             samps_per_chan=self.total_ticks,
         )
 
-        self.ci_task.in_stream.input_buf_size = self.total_ticks
+        self.ci_task.in_stream.input_buf_size = max(self.total_ticks, 4 * every_n)
 
         self.reader = CounterReader(self.ci_task.in_stream)
-        self.reader.read_all_avail_samp = True
 
-        self.count_arr = np.zeros(total_ticks, dtype=np.uint32)
+        # ring of samples, head counts all samples written
+        self.ring = np.zeros(self.capacity, dtype=np.uint32)
+        self.head = 0
+        self._block = np.zeros(every_n, dtype=np.uint32)
+
+        self.stats = TickStats()
+        self._last_count = 0
+        # reentrant, wait() reads the last block while holding it
+        self._lock = threading.RLock()
+        self._done = threading.Event()
+
+        self.ci_task.register_every_n_samples_acquired_into_buffer_event(
+            every_n, self._on_samples
+        )
+
+    def _on_samples(self, task_handle, event_type, num_samples, callback_data):
+        # runs on a DAQmx thread, samples past the total are left to stop()
+        if not self._done.is_set():
+            self._read(num_samples)
+        return 0
+
+    def _read(self, num_samples: int):
+        block = self._block[:num_samples]
+        if num_samples > self._block.size:
+            block = np.zeros(num_samples, dtype=np.uint32)
+
+        with self._lock:
+            self.reader.read_many_sample_uint32(
+                block, number_of_samples_per_channel=num_samples, timeout=0
+            )
+            self._append(block)
+
+        if self.head >= self.total_ticks:
+            self._done.set()
+
+    def _append(self, block: ndarray):
+        # incremental statistics from the count deltas
+        deltas = np.diff(block.astype(np.int64), prepend=self._last_count)
+        self.stats.ticks += block.size
+        self.stats.skipped += int(np.count_nonzero(deltas == 0))
+        self.stats.extra += int(np.sum(deltas[deltas > 1] - 1))
+        self._last_count = int(block[-1])
+
+        # copy into the ring, wrapping around its end
+        start = self.head % self.capacity
+        first = min(block.size, self.capacity - start)
+        self.ring[start : start + first] = block[:first]
+        self.ring[: block.size - first] = block[first:]
+        self.head += block.size
 
     def start(self):
+        """Start counting, returns immediately"""
+        self._done.clear()
         self.ci_task.start()
 
-        self.reader.read_many_sample_uint32(
-            self.count_arr, number_of_samples_per_channel=self.total_ticks, timeout=0.1
-        )
+    def wait(self, timeout: float = None, poll: float = 0.01) -> bool:
+        """Wait until total_ticks samples were received
+
+        The callback only fires on full blocks, so the last partial block
+        is read here as soon as the device buffer holds all of it. Returns
+        False if the samples did not arrive within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not self._done.wait(poll):
+            with self._lock:
+                remaining = self.total_ticks - self.head
+                available = self.ci_task.in_stream.avail_samp_per_chan
+                if 0 < remaining <= available:
+                    self._read(remaining)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return self._done.is_set()
+
+        return True
 
     def stop(self):
+        """Read the last partial block, then stop and close the task"""
+        remaining = self.ci_task.in_stream.avail_samp_per_chan
+        if remaining:
+            self._read(remaining)
+
         self.ci_task.stop()
         self.ci_task.close()
 
+    @property
+    def count_arr(self) -> ndarray:
+        """Samples held in the ring in tick order"""
+        with self._lock:
+            if self.head <= self.capacity:
+                return self.ring[: self.head].copy()
+
+            start = self.head % self.capacity
+            return np.concatenate((self.ring[start:], self.ring[:start]))
+
+    def frame_ticks(self, frame_ids: ndarray) -> ndarray:
+        """Return the encoder tick at which each camera frame was exposed
+
+        Frame IDs are the camera block IDs counting from 0 at the start of
+        grabbing, so frames the host dropped keep their place. Frames
+        outside the recorded ticks map to -1
+        """
+        counts = self.count_arr
+        first_tick = max(self.head - self.capacity, 0)
+
+        # the count reaches n + 1 at the tick that exposed frame n
+        ticks = np.searchsorted(counts, np.asarray(frame_ids) + 1, side="left")
+        valid = ticks < counts.size
+        if first_tick:
+            # frames exposed before the oldest tick in the ring are unknown
+            valid &= ticks > 0
+
+        return np.where(valid, ticks + first_tick, -1)
+
+    def frame_positions(
+        self, frame_ids: ndarray, start_mm: float, tick_mm: float
+    ) -> ndarray:
+        """Return the stage position of each camera frame in mm
+
+        start_mm is the position of the first tick and tick_mm the encoder
+        divide in mm. Unmatched frames are NaN
+        """
+        ticks = self.frame_ticks(frame_ids)
+        return np.where(ticks >= 0, start_mm + ticks * tick_mm, np.nan)
+
     def plot_data(self):
+        counts = self.count_arr
+
         fig, (ax1, ax2) = plt.subplots(1, 2)
-        fig.suptitle("DAQ signal recording")
-        ax1.plot(self.count_arr)
+        fig.suptitle(f"DAQ signal recording ({self.stats})")
+        ax1.plot(counts)
         ax1.grid()
 
-        deltas = self.count_arr[1:] - self.count_arr[:-1]
-        ax2.plot([0, self.total_ticks], [0, self.total_ticks], "r--")
+        deltas = np.diff(counts.astype(np.int64))
+        ax2.plot([0, counts.size], [0, counts.size], "r--")
         ax2.plot(deltas, "k", alpha=0.5)
-        ax2.plot(self.count_arr)
+        ax2.plot(counts)
         ax2.grid()
 
-        ax2.title("Skipped frames")
-        ax2.xlabel("Encoder ticks")
-        ax2.ylabel("Images captured")
+        ax2.set_title("Skipped frames")
+        ax2.set_xlabel("Encoder ticks")
+        ax2.set_ylabel("Images captured")
 
         fig.show()
@@ -1,92 +1,129 @@
-import os
-import json
 import numpy as np
+import processing.calibration as calibration
 
 from numpy import ndarray
 
 
-def reformat(arr: ndarray) -> ndarray:
-    if arr.dtype != np.float64:
-        if arr.dtype in (np.uint8, np.uint16):
-            return arr.astype(np.float64)
-        else:
-            print(f"Image has unsuported data type {arr.dtype}")
-            raise TypeError
+def validate(arr: ndarray):
+    if arr.dtype not in (np.uint8, np.uint16, np.float64):
+        print(f"Image has unsuported data type {arr.dtype}")
+        raise TypeError
+
+
+def crop_offset(diff: int) -> int:
+    """Number of leading rows (or cols) removed to center a crop
+
+    An odd surplus drops the extra line from the start, except when
+    only a single line is removed
+    """
+    if diff == 1:
+        return 0
+    return (diff + 1) // 2
+
+
+def crop_window(shape: tuple, rows: ndarray, cols: ndarray) -> tuple:
+    """Compute the common crop window of each plane from integer offsets
+
+    Positive offsets remove rows (cols) from the top (left) of a plane and
+    negative offsets from the bottom (right). Planes are then centered on
+    the smallest remaining plane. Returns (starts, size) where starts holds
+    the (row, col) origin of each plane and size the (height, width) of
+    the window
+    """
+    rows = np.asarray(rows, dtype=int)
+    cols = np.asarray(cols, dtype=int)
+
+    heights = shape[1] - np.abs(rows)
+    widths = shape[2] - np.abs(cols)
+    height, width = int(np.amin(heights)), int(np.amin(widths))
+
+    starts = np.empty((shape[0], 2), dtype=int)
+    for i in range(shape[0]):
+        starts[i, 0] = max(rows[i], 0) + crop_offset(heights[i] - height)
+        starts[i, 1] = max(cols[i], 0) + crop_offset(widths[i] - width)
+
+    return starts, (height, width)
+
+
+def shift_planes(
+    arr: ndarray, rows: ndarray, cols: ndarray, dtype: np.dtype = None
+) -> ndarray:
+    """Resample each plane by fractional row and column offsets
+
+    Offsets follow the alignment data convention, where the values of a
+    mirrored pair are +/- d for a relative shift d. Each plane is therefore
+    displaced by half its value relative to the stack center. Planes are
+    sampled with bilinear interpolation and cropped to the common window
+    """
+    # sampling origin of each plane in source pixel coordinates
+    origin_r = (np.asarray(rows, dtype=np.float64) - np.amin(rows)) / 2
+    origin_c = (np.asarray(cols, dtype=np.float64) - np.amin(cols)) / 2
+
+    # leave room for the neighbor sample of the interpolation
+    height = int(np.floor(arr.shape[1] - 1 - np.amax(origin_r)))
+    width = int(np.floor(arr.shape[2] - 1 - np.amax(origin_c)))
+
+    if dtype is None:
+        dtype = arr.dtype
+    out = np.empty((arr.shape[0], height, width), dtype=dtype)
+
+    for i in range(arr.shape[0]):
+        r, c = int(origin_r[i]), int(origin_c[i])
+        fr = np.float32(origin_r[i] - r)
+        fc = np.float32(origin_c[i] - c)
+
+        plane = arr[i].astype(np.float32, copy=False)
+
+        top = plane[r : r + height, c : c + width] * (1 - fc)
+        top += plane[r : r + height, c + 1 : c + width + 1] * fc
+        bottom = plane[r + 1 : r + height + 1, c : c + width] * (1 - fc)
+        bottom += plane[r + 1 : r + height + 1, c + 1 : c + width + 1] * fc
+
+        top *= 1 - fr
+        bottom *= fr
+        top += bottom
+
+        if np.issubdtype(dtype, np.integer):
+            np.rint(top, out=top)
+        out[i] = top
+
+    return out
+
+
+def align(
+    arr: ndarray, setup: str = "tilt", out: ndarray = None, copy: bool = True
+) -> ndarray:
+    """Align image planes with the stored calibration offsets
+
+    Integer offsets select one crop window per plane, which is copied into
+    a single output array in the original dtype (or into out). With
+    copy=False a view of the input is returned when every plane shares the
+    same window. Fractional offsets from sub-pixel registration are
+    resampled with shift_planes
+    """
+    validate(arr)
+
+    # alignment data is cached after the first read
+    offsets = calibration.store.alignment(arr.shape[0], setup)
+
+    if offsets is None:
+        rows = cols = np.zeros((arr.shape[0],), dtype=int)
     else:
-        return arr
-
-
-def crop(arr: list) -> ndarray:
-    shape = list(arr[0].shape)
-
-    for i in arr:
-        if i.shape[0] < shape[0]:
-            shape[0] = i.shape[0]
-        if i.shape[1] < shape[1]:
-            shape[1] = i.shape[1]
-
-    for i in range(len(arr)):
-        if arr[i].shape[0] > shape[0]:
-            diff = arr[i].shape[0] - shape[0]
-
-            if diff == 1:
-                arr[i] = arr[i][:-1]
-            else:
-                if diff % 2:
-                    arr[i] = arr[i][int(diff / 2) + 1 : int(-diff / 2)]
-                else:
-                    arr[i] = arr[i][int(diff / 2) : int(-diff / 2)]
-
-        if arr[i].shape[1] > shape[1]:
-            diff = arr[i].shape[1] - shape[1]
-
-            if diff == 1:
-                arr[i] = arr[i][:, :-1]
-            else:
-                if diff % 2:
-                    arr[i] = arr[i][:, int(diff / 2) + 1 : int(-diff / 2)]
-                else:
-                    arr[i] = arr[i][:, int(diff / 2) : int(-diff / 2)]
-
-    return np.stack(arr, axis=0).astype(np.uint16)
-
-
-def align(arr: ndarray) -> ndarray:
-    arr = reformat(arr)
-
-    # for easier processing, break image stack into list
-    arr = [arr[i] for i in range(arr.shape[0])]
-
-    # read alignment data file
-    file_dir = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), "align_data_tilt.json"
-    )
-    if os.path.exists(file_dir):
-        with open(file_dir) as file:
-            align_data = json.loads(file.read())
-
-        # extract data corresponding to the number of image planes
-        align_data = align_data[str(len(arr))]
-
-        for i in range(len(arr)):
-            row_shift = align_data["rows"][i]
-            if row_shift < 0:
-                # shift down
-                arr[i] = arr[i][:row_shift]
-            elif row_shift > 0:
-                # shift up
-                arr[i] = arr[i][row_shift:]
-            else:
-                pass
-
-            col_shift = align_data["cols"][i]
-            if col_shift < 0:
-                # shift right
-                arr[i] = arr[i][:, :col_shift]
-            elif col_shift > 0:
-                # shift left
-                arr[i] = arr[i][:, col_shift:]
-            else:
-                pass
-
-    return crop(arr)
+        rows, cols = offsets
+
+    if not np.issubdtype(rows.dtype, np.integer):
+        return shift_planes(arr, rows, cols, dtype=arr.dtype)
+
+    starts, (height, width) = crop_window(arr.shape, rows, cols)
+
+    if not copy and np.all(starts == starts[0]):
+        r, c = starts[0]
+        return arr[:, r : r + height, c : c + width]
+
+    if out is None:
+        out = np.empty((arr.shape[0], height, width), dtype=arr.dtype)
+
+    for i, (r, c) in enumerate(starts):
+        out[i] = arr[i, r : r + height, c : c + width]
+
+    return out
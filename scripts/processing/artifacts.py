@@ -1,33 +1,40 @@
-import os
-import json
 import warnings
 import numpy as np
+import processing.calibration as calibration
 
 from numpy import ndarray
 
 
-def filter_col_artifacts(arr: ndarray) -> ndarray:
+def gain_table(num_planes: int, setup: str = "tilt") -> ndarray:
+    """Return the float32 reciprocal gain table for a plane count
+
+    Table has shape (num_planes, width) and is cached by the calibration
+    store. Returns None if the filter values file is missing
+    """
+    return calibration.store.gain(num_planes, setup)
+
+
+def filter_col_artifacts(
+    arr: ndarray, out: ndarray = None, dtype: np.dtype = None, setup: str = "tilt"
+) -> ndarray:
     """Remove artifact interference patterns from imaging planes
 
     Assume filter values file is located in same parent directory
-    """
-    file_dir = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), "artifact_data_tilt.json"
-    )
-    if os.path.exists(file_dir):
-        with open(file_dir) as file:
-            cal_data = json.loads(file.read())
 
-        # extract data corresponding to the number of image planes
-        cal_data = cal_data[str(arr.shape[0])]
+    The gain table is broadcast over all rows in a single float32 multiply,
+    so uint16 input is never widened to float64. Pass out=arr to correct
+    in place, or dtype to choose the output type of a new array (defaults
+    to the input type)
+    """
+    gain = gain_table(arr.shape[0], setup)
 
-        # use either amin or mean
-        cal_data = np.multiply(cal_data, (1 / np.amin(cal_data)))
+    if gain is not None:
+        if out is None:
+            out = np.empty(arr.shape, dtype=arr.dtype if dtype is None else dtype)
 
-        for p in range(arr.shape[0]):
-            for r in range(arr.shape[1]):
-                arr[p][r] = arr[p][r] / cal_data[p]
+        # values are truncated when written to integer outputs
+        np.multiply(arr, gain[:, np.newaxis, :], out=out, casting="unsafe")
 
-        return arr
+        return out
     else:
         warnings.warn("Missing filter values file!")
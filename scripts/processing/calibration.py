@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from numpy import ndarray
+
+
+def parse_alignment(data: dict) -> dict:
+    """Convert alignment data into (rows, cols) arrays keyed by plane count
+
+    Offsets stay integer unless the file holds sub-pixel values
+    """
+    tables = {}
+    for num_planes, vals in data.items():
+        offsets = np.asarray([vals["rows"], vals["cols"]], dtype=np.float64)
+        if np.all(np.mod(offsets, 1) == 0):
+            offsets = offsets.astype(int)
+        tables[int(num_planes)] = (offsets[0], offsets[1])
+    return tables
+
+
+def parse_artifacts(data: dict) -> dict:
+    """Convert filter values into reciprocal gain tables keyed by plane count"""
+    tables = {}
+    for num_planes, vals in data.items():
+        cal_data = np.asarray(vals, dtype=np.float64)
+
+        # use either amin or mean
+        tables[int(num_planes)] = (np.amin(cal_data) / cal_data).astype(np.float32)
+    return tables
+
+
+class CalibrationStore:
+    """Cache of calibration tables loaded from the processing directory
+
+    Each file is parsed once into ready-to-use NumPy arrays. A file is
+    re-read only when its modification time changes and re-parsed only
+    when the hash of its contents differs
+    """
+
+    def __init__(self, cal_dir: str = None):
+        if cal_dir is None:
+            cal_dir = os.path.dirname(os.path.realpath(__file__))
+        self.cal_dir = cal_dir
+
+        # file path => mtime, content hash, and parsed tables
+        self._files = {}
+
+    def load(self, fname: str, parse: callable) -> dict:
+        """Return the parsed tables of a calibration file
+
+        Returns None if the file does not exist
+        """
+        file_dir = os.path.join(self.cal_dir, fname)
+        if not os.path.exists(file_dir):
+            self._files.pop(file_dir, None)
+            return None
+
+        mtime = os.stat(file_dir).st_mtime_ns
+        entry = self._files.get(file_dir)
+
+        if entry is not None and entry["mtime"] == mtime:
+            return entry["tables"]
+
+        with open(file_dir, "rb") as file:
+            content = file.read()
+        digest = hashlib.sha1(content).hexdigest()
+
+        if entry is not None and entry["digest"] == digest:
+            # file was touched but not modified
+            tables = entry["tables"]
+        else:
+            tables = parse(json.loads(content))
+
+        self._files[file_dir] = {"mtime": mtime, "digest": digest, "tables": tables}
+        return tables
+
+    def alignment(self, num_planes: int, setup: str = "tilt") -> tuple:
+        """Return (rows, cols) alignment offsets for a plane count"""
+        tables = self.load(f"align_data_{setup}.json", parse_alignment)
+        if tables is None:
+            return None
+        return tables[num_planes]
+
+    def gain(self, num_planes: int, setup: str = "tilt") -> ndarray:
+        """Return the float32 reciprocal gain table for a plane count"""
+        tables = self.load(f"artifact_data_{setup}.json", parse_artifacts)
+        if tables is None:
+            return None
+        return tables[num_planes]
+
+    def clear(self):
+        """Drop all cached tables"""
+        self._files.clear()
+
+
+# shared by the processing modules
+store = CalibrationStore()
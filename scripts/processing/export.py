@@ -0,0 +1,88 @@
+import json
+import zarr
+import numpy as np
+import tifffile as tf
+
+from numpy import ndarray
+from xml.etree import ElementTree
+
+
+def downsample(arr: ndarray) -> ndarray:
+    """Bin each plane 2x2 by averaging, keeping the data type"""
+    height, width = arr.shape[1] // 2 * 2, arr.shape[2] // 2 * 2
+
+    out = np.empty((arr.shape[0], height // 2, width // 2), dtype=arr.dtype)
+    for i in range(arr.shape[0]):
+        # one plane at a time keeps the float copy small
+        plane = arr[i, :height, :width].astype(np.float32)
+        out[i] = plane.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+
+    return out
+
+
+def write_reconstruction(
+    fname: str,
+    img_arr: ndarray,
+    params: dict = None,
+    pixel_size_mm: float = None,
+    tile: tuple = (256, 256),
+    compression: str = "zlib",
+    levels: int = 3,
+    maxworkers: int = None,
+):
+    """Write a z/y/x reconstruction as a tiled, compressed OME-TIFF pyramid
+
+    Each plane is split into tiles that are compressed in parallel by
+    maxworkers threads (default is all cores). Downsampled levels are
+    stored as sub-resolution images so viewers can open overviews without
+    reading the full stack. Acquisition parameters are embedded as JSON in
+    the image description
+    """
+    if img_arr.dtype != np.uint16:
+        img_arr = img_arr.astype(np.uint16)
+
+    metadata = {"axes": "ZYX"}
+    if params is not None:
+        metadata["Description"] = json.dumps(params)
+    if pixel_size_mm is not None:
+        metadata["PhysicalSizeX"] = pixel_size_mm * 1e3
+        metadata["PhysicalSizeXUnit"] = "µm"
+        metadata["PhysicalSizeY"] = pixel_size_mm * 1e3
+        metadata["PhysicalSizeYUnit"] = "µm"
+
+    options = {
+        "tile": tile,
+        "compression": compression,
+        "photometric": "minisblack",
+        "maxworkers": maxworkers,
+    }
+
+    with tf.TiffWriter(fname, bigtiff=True, ome=True) as tif:
+        tif.write(img_arr, subifds=levels - 1, metadata=metadata, **options)
+
+        level = img_arr
+        for _ in range(levels - 1):
+            level = downsample(level)
+            tif.write(level, subfiletype=1, **options)
+
+
+def read_params(fname: str) -> dict:
+    """Return the acquisition parameters embedded in a reconstruction"""
+    with tf.TiffFile(fname) as tif:
+        ome = ElementTree.fromstring(tif.ome_metadata)
+
+    for element in ome.iter():
+        if element.tag.endswith("Description") and element.text:
+            return json.loads(element.text)
+
+    return {}
+
+
+def open_reconstruction(fname: str, level: int = 0) -> zarr.Array:
+    """Open one pyramid level of a reconstruction as a lazy zarr array
+
+    Only the tiles covering the requested sub-region are read and
+    decompressed when the array is sliced
+    """
+    store = tf.imread(fname, aszarr=True, level=level)
+    return zarr.open(store, mode="r")
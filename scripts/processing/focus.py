@@ -0,0 +1,66 @@
+import numpy as np
+
+from numpy import ndarray
+from processing.registration import refine_vertex
+
+
+def decimate(img: ndarray, roi: tuple = None, step: int = 1) -> ndarray:
+    """Return a strided view of a region of interest
+
+    roi is (row, col, height, width), the full frame if None. Keeping every
+    step-th row and column cuts the cost of scoring by step**2 while
+    keeping edges, which is all the focus metrics respond to
+    """
+    if roi is not None:
+        row, col, height, width = roi
+        img = img[row : row + height, col : col + width]
+    return img[::step, ::step]
+
+
+def gradient_score(img: ndarray) -> float:
+    """Mean squared intensity gradient (Tenengrad without smoothing)
+
+    Highest for the sharpest image, and robust to noise on low contrast
+    samples since it sums over the whole frame
+    """
+    img = img.astype(np.float32)
+    dy = np.diff(img, axis=0)
+    dx = np.diff(img, axis=1)
+    return float(
+        (np.einsum("ij,ij->", dy, dy) + np.einsum("ij,ij->", dx, dx)) / img.size
+    )
+
+
+def variance_score(img: ndarray) -> float:
+    """Intensity variance normalized by the mean
+
+    Less sensitive to the sample than gradient_score but also to defocus,
+    the normalization cancels illumination drift during a sweep
+    """
+    img = img.astype(np.float32)
+    mean = img.mean()
+    if mean == 0:
+        return 0.0
+    return float(img.var() / mean)
+
+
+METRICS = {"gradient": gradient_score, "variance": variance_score}
+
+
+def peak_position(positions: ndarray, scores: ndarray) -> float:
+    """Interpolate the position of the highest score
+
+    A parabola is fitted through the best score and its neighbors, so the
+    result can fall between sampled positions
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    i = int(np.argmax(scores))
+    (offset,) = refine_vertex(-scores, (i,))
+
+    if offset < 0:
+        return positions[i] + offset * (positions[i] - positions[i - 1])
+    if offset > 0:
+        return positions[i] + offset * (positions[i + 1] - positions[i])
+    return positions[i]
@@ -0,0 +1,306 @@
+import numpy as np
+
+from numpy import ndarray
+from scipy import fft
+from matplotlib import pyplot as plt
+
+
+def shift_error(
+    ref: ndarray,
+    mov: ndarray,
+    axis: int = 0,
+    max_shift: int = None,
+    block: int = 256,
+    normalize: bool = False,
+) -> tuple:
+    """Compute the shift error curve for every lag in a single pass
+
+    Lag d compares ref[k] with mov[k + d] along the given axis for every
+    |d| < max_shift. The error is the root sum of squared differences over
+    the overlapping region, identical to the brute-force search, but the
+    cross term is evaluated for all lags at once with an FFT
+    cross-correlation and the overlap energies come from cumulative sums.
+    Cost is O(H * W * log H) no matter how wide the search window is
+    (max_shift=None searches the full frame). With normalize=True the sum
+    is divided by the number of overlapping pixels (root mean squared
+    difference), which full-frame searches need since the largest lags
+    otherwise win on their small overlap
+
+    Returns a tuple of (lags, errors)
+    """
+    if ref.shape != mov.shape:
+        raise ValueError("Image planes must have the same shape")
+
+    # move the shift axis to the front (views, no copies)
+    ref = np.moveaxis(ref, axis, 0).reshape(ref.shape[axis], -1)
+    mov = np.moveaxis(mov, axis, 0).reshape(mov.shape[axis], -1)
+
+    length = ref.shape[0]
+    if max_shift is None or max_shift > length:
+        max_shift = length
+
+    # zero-pad to avoid circular wrap-around of the correlation
+    size = fft.next_fast_len(2 * length - 1, real=True)
+
+    spectrum = np.zeros(size // 2 + 1, dtype=np.complex128)
+    energy_ref = np.zeros(length, dtype=np.float64)
+    energy_mov = np.zeros(length, dtype=np.float64)
+
+    # process in column blocks to bound memory use on full-size stacks
+    for c in range(0, ref.shape[1], block):
+        a = ref[:, c : c + block].astype(np.float64)
+        b = mov[:, c : c + block].astype(np.float64)
+
+        energy_ref += np.einsum("ij,ij->i", a, a)
+        energy_mov += np.einsum("ij,ij->i", b, b)
+
+        fa = fft.rfft(a, n=size, axis=0, workers=-1)
+        fb = fft.rfft(b, n=size, axis=0, workers=-1)
+
+        # correlation is linear, so sum over columns in frequency space
+        spectrum += np.einsum("ij,ij->i", np.conj(fa), fb)
+
+    corr = fft.irfft(spectrum, n=size)
+
+    # prefix sums give the energy of any run of rows in O(1)
+    cum_ref = np.concatenate(([0.0], np.cumsum(energy_ref)))
+    cum_mov = np.concatenate(([0.0], np.cumsum(energy_mov)))
+
+    lags = np.arange(1 - max_shift, max_shift)
+    pos = lags >= 0
+
+    ref_start = np.where(pos, 0, -lags)
+    ref_stop = np.where(pos, length - lags, length)
+    mov_start = np.where(pos, lags, 0)
+    mov_stop = np.where(pos, length, length + lags)
+
+    ssd = (
+        (cum_ref[ref_stop] - cum_ref[ref_start])
+        + (cum_mov[mov_stop] - cum_mov[mov_start])
+        - 2 * corr[lags % size]
+    )
+
+    # rounding can push perfect matches slightly below zero
+    ssd = np.clip(ssd, 0, None)
+
+    if normalize:
+        ssd /= (ref_stop - ref_start) * ref.shape[1]
+
+    return lags, np.sqrt(ssd)
+
+
+def shift_error_2d(
+    ref: ndarray, mov: ndarray, max_shift: tuple = (200, 20), normalize: bool = True
+) -> tuple:
+    """Compute the joint row/column shift error surface in a single pass
+
+    Lag (dr, dc) compares ref[k, j] with mov[k + dr, j + dc] for every
+    |dr| < max_shift[0] and |dc| < max_shift[1]. The cross term comes from
+    one 2D FFT cross-correlation and the overlap energies from summed-area
+    tables. With normalize=True the error is the mean squared difference per
+    overlapping pixel, which does not favor large shifts
+
+    Returns a tuple of (row_lags, col_lags, errors)
+    """
+    if ref.shape != mov.shape:
+        raise ValueError("Image planes must have the same shape")
+
+    height, width = ref.shape
+    max_r = min(max_shift[0], height)
+    max_c = min(max_shift[1], width)
+
+    # padding by the search window is enough to keep wrap-around out of range
+    size = (
+        fft.next_fast_len(height + max_r - 1),
+        fft.next_fast_len(width + max_c - 1, real=True),
+    )
+
+    a = ref.astype(np.float64)
+    b = mov.astype(np.float64)
+
+    fa = fft.rfft2(a, s=size, workers=-1)
+    fb = fft.rfft2(b, s=size, workers=-1)
+    fa = np.conj(fa, out=fa)
+    fa *= fb
+    del fb
+    corr = fft.irfft2(fa, s=size, workers=-1)
+    del fa
+
+    # summed-area tables of the squared planes
+    sat_ref = np.zeros((height + 1, width + 1), dtype=np.float64)
+    sat_mov = np.zeros((height + 1, width + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(np.square(a, out=a), axis=0), axis=1, out=sat_ref[1:, 1:])
+    np.cumsum(np.cumsum(np.square(b, out=b), axis=0), axis=1, out=sat_mov[1:, 1:])
+
+    row_lags = np.arange(1 - max_r, max_r)
+    col_lags = np.arange(1 - max_c, max_c)
+
+    def bounds(lags, length):
+        pos = lags >= 0
+        return (
+            np.where(pos, 0, -lags),
+            np.where(pos, length - lags, length),
+            np.where(pos, lags, 0),
+            np.where(pos, length, length + lags),
+        )
+
+    r0, r1, rm0, rm1 = (i[:, None] for i in bounds(row_lags, height))
+    c0, c1, cm0, cm1 = (i[None, :] for i in bounds(col_lags, width))
+
+    energy_ref = sat_ref[r1, c1] - sat_ref[r0, c1] - sat_ref[r1, c0] + sat_ref[r0, c0]
+    energy_mov = (
+        sat_mov[rm1, cm1] - sat_mov[rm0, cm1] - sat_mov[rm1, cm0] + sat_mov[rm0, cm0]
+    )
+
+    cross = corr[np.ix_(row_lags % size[0], col_lags % size[1])]
+    errors = np.clip(energy_ref + energy_mov - 2 * cross, 0, None)
+
+    if normalize:
+        errors /= (r1 - r0) * (c1 - c0)
+
+    return row_lags, col_lags, errors
+
+
+def refine_vertex(errors: ndarray, index: tuple) -> tuple:
+    """Fit a parabola through the neighbors of the error minimum
+
+    Returns the sub-pixel offset along each axis (within +/- 0.5 pix)
+    """
+    offsets = []
+    for axis, i in enumerate(index):
+        if i == 0 or i == errors.shape[axis] - 1:
+            # minimum on the edge of the search window
+            offsets.append(0.0)
+            continue
+
+        lo, hi = list(index), list(index)
+        lo[axis] -= 1
+        hi[axis] += 1
+
+        e_lo, e_mid, e_hi = errors[tuple(lo)], errors[index], errors[tuple(hi)]
+        curvature = e_lo - 2 * e_mid + e_hi
+
+        if curvature <= 0:
+            offsets.append(0.0)
+        else:
+            offsets.append(float(np.clip(0.5 * (e_lo - e_hi) / curvature, -0.5, 0.5)))
+
+    return tuple(offsets)
+
+
+def register(
+    arr: ndarray, max_shift: tuple = (200, 20), subpixel: bool = True
+) -> tuple:
+    """Estimate row and column offsets of each plane in a joint search
+
+    Each pair of mirrored planes is registered once over the 2D shift
+    window. With subpixel=True the error minimum is refined with a
+    parabolic fit. Returns (rows, cols) in the alignment data convention
+    """
+    rows = np.zeros((arr.shape[0],), dtype=np.float64)
+    cols = np.zeros((arr.shape[0],), dtype=np.float64)
+
+    for i in range(int(arr.shape[0] / 2)):
+        row_lags, col_lags, errors = shift_error_2d(arr[i], arr[-i - 1], max_shift)
+
+        index = np.unravel_index(np.argmin(errors), errors.shape)
+        lag_r, lag_c = float(row_lags[index[0]]), float(col_lags[index[1]])
+
+        if subpixel:
+            offset_r, offset_c = refine_vertex(errors, index)
+            lag_r += offset_r
+            lag_c += offset_c
+
+        rows[i], rows[-i - 1] = -lag_r, lag_r
+        cols[i], cols[-i - 1] = -lag_c, lag_c
+
+        print(
+            f"Plane {i} is shifted by ({lag_r:.2f}, {lag_c:.2f}) pix "
+            f"relative to plane {len(arr) -i -1}"
+        )
+
+    if not subpixel:
+        return rows.astype(int), cols.astype(int)
+
+    return rows, cols
+
+
+def plane_shift(arr: ndarray, axis: int, max_shift: int = None) -> tuple:
+    """Find the best shift between each pair of mirrored image planes
+
+    Plane i is compared with plane -i - 1. Returns a tuple of (shifts, lags,
+    errors) where shifts holds the signed per-plane values stored in the
+    alignment data files and (lags, errors) is the curve of the last pair
+    """
+    shifts = np.zeros((arr.shape[0],), dtype=int)
+    lags, errors = None, None
+
+    for i in range(int(arr.shape[0] / 2)):
+        # plane axis is removed when indexing
+        lags, errors = shift_error(arr[i], arr[-i - 1], axis - 1, max_shift)
+
+        lag = lags[np.argmin(errors)]
+        shifts[i] = -lag
+        shifts[-i - 1] = lag
+
+    return shifts, lags, errors
+
+
+def plot_error(lags: ndarray, errors: ndarray, fname: str):
+    """Save the shift error curve of a plane pair"""
+    fig = plt.figure()
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.plot(lags, errors)
+    fig.savefig(fname, bbox_inches="tight")
+
+
+def row_shift(arr: ndarray, max_shift: int = 200, plot: bool = False) -> ndarray:
+    """Return the number of rows to remove from each plane
+
+    Positive values remove rows from the top of the plane, negative
+    values remove rows from the bottom
+    """
+    rows, lags, errors = plane_shift(arr, axis=1, max_shift=max_shift)
+
+    for i in range(int(arr.shape[0] / 2)):
+        if rows[i] < 0:
+            print(
+                f"Remove {-rows[i]} rows from the bottom of plane {i} and "
+                f"top of plane {len(arr) -i -1}"
+            )
+        else:
+            print(
+                f"Remove {rows[i]} rows from the top of plane {i} and "
+                f"bottom of plane {len(arr) -i -1}"
+            )
+
+    if plot and lags is not None:
+        plot_error(lags, errors, "error_y.jpg")
+
+    return rows.astype(np.int16)
+
+
+def col_shift(arr: ndarray, max_shift: int = 20, plot: bool = False) -> ndarray:
+    """Return the number of columns to remove from each plane
+
+    Positive values remove columns from the left of the plane, negative
+    values remove columns from the right
+    """
+    cols, lags, errors = plane_shift(arr, axis=2, max_shift=max_shift)
+
+    for i in range(int(arr.shape[0] / 2)):
+        if cols[i] > 0:
+            print(
+                f"Remove {cols[i]} cols from the left of plane {i} and "
+                f"right of plane {len(arr) -i -1}"
+            )
+        else:
+            print(
+                f"Remove {-cols[i]} cols from the right of plane {i} and "
+                f"left of plane {len(arr) -i -1}"
+            )
+
+    if plot and lags is not None:
+        plot_error(lags, errors, "error_x.jpg")
+
+    return cols
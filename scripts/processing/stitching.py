@@ -0,0 +1,243 @@
+import os
+import zarr
+import warnings
+import numpy as np
+import processing.export as export
+
+from numpy import ndarray
+from processing.registration import shift_error_2d
+
+
+def strip_origin(positions: ndarray, pixel_size_mm: float) -> float:
+    """Estimate the stage position (mm) of the first row of a strip
+
+    Positions are the encoder positions of each frame in the row order of
+    the strip, NaN where a frame has no encoder tick. The median over all
+    frames is robust to dropped frames and jitter of single ticks
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    origins = positions - np.arange(positions.size) * pixel_size_mm
+
+    if np.all(np.isnan(origins)):
+        return None
+
+    return float(np.nanmedian(origins))
+
+
+class Mosaic:
+    """Place overlapping scan strips in a chunked on-disk canvas
+
+    The canvas has the z/y/x layout of the reconstructions: rows run along
+    the scan (stage x) and columns across the strips (stage y). Strips are
+    added one at a time in the order they are scanned. Each strip is put at
+    its nominal stage position, refined by registering the overlap with the
+    previous strip, and the seam is feathered over blend_width columns.
+    Strips are written in chunk-sized blocks, so memory use does not grow
+    with the scanned area
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        shape: tuple,
+        pixel_size_mm: float,
+        origin_mm: tuple = (0, 0),
+        chunks: tuple = (1, 1024, 1024),
+        blend_width: int = 64,
+        max_shift: tuple = (50, 20),
+        reg_rows: int = 4096,
+    ):
+        self.canvas = zarr.open(
+            fname, mode="w", shape=shape, chunks=chunks, dtype=np.uint16, fill_value=0
+        )
+        self.canvas.attrs["pixel_size_mm"] = pixel_size_mm
+        self.canvas.attrs["origin_mm"] = [float(v) for v in origin_mm]
+
+        self.pixel_size_mm = pixel_size_mm
+        self.origin_mm = origin_mm
+        self.blend_width = blend_width
+        self.max_shift = max_shift
+        self.reg_rows = reg_rows
+
+        # canvas extent (r0, r1, c0, c1) of the previous strip
+        self.last = None
+        self.placements = []
+
+    def locate(self, x_mm: float, y_mm: float) -> tuple:
+        """Return the canvas (row, col) of a stage position"""
+        return (
+            round((x_mm - self.origin_mm[0]) / self.pixel_size_mm),
+            round((y_mm - self.origin_mm[1]) / self.pixel_size_mm),
+        )
+
+    def register(self, strip: ndarray, r0: int, c0: int) -> tuple:
+        """Refine the canvas position of a strip against the previous one
+
+        Only a window of reg_rows rows from the middle of the overlap is
+        compared, on the middle plane. Falls back to the nominal position
+        if the strips do not overlap or the match is on the edge of the
+        search window
+        """
+        if self.last is None:
+            return r0, c0
+
+        pr0, pr1, pc0, pc1 = self.last
+        ra, rb = max(r0, pr0), min(r0 + strip.shape[1], pr1)
+        ca, cb = max(c0, pc0), min(c0 + strip.shape[2], pc1)
+
+        if rb - ra < 2 * self.max_shift[0] or cb - ca < 2 * self.max_shift[1]:
+            warnings.warn("Strip overlap too small to register, using stage position")
+            return r0, c0
+
+        if rb - ra > self.reg_rows:
+            ra = (ra + rb - self.reg_rows) // 2
+            rb = ra + self.reg_rows
+
+        plane = strip.shape[0] // 2
+        ref = self.canvas[plane, ra:rb, ca:cb]
+        mov = strip[plane, ra - r0 : rb - r0, ca - c0 : cb - c0]
+
+        row_lags, col_lags, errors = shift_error_2d(ref, mov, self.max_shift)
+        i, j = np.unravel_index(np.argmin(errors), errors.shape)
+
+        if i in (0, errors.shape[0] - 1) or j in (0, errors.shape[1] - 1):
+            warnings.warn(
+                "Strip registration hit the search limit, using stage position"
+            )
+            return r0, c0
+
+        # lag (dr, dc) matches ref[k, j] with mov[k + dr, j + dc]
+        return r0 - int(row_lags[i]), c0 - int(col_lags[j])
+
+    def add(self, strip: ndarray, x_mm: float, y_mm: float) -> tuple:
+        """Register, blend and write a z/y/x strip at a stage position (mm)
+
+        The stage position is that of the first row and column. Strips can
+        be lazy arrays, e.g. from export.open_reconstruction. Returns the
+        canvas (row, col) the strip was placed at
+        """
+        r0, c0 = self.register(strip, *self.locate(x_mm, y_mm))
+
+        r1, c1 = r0 + strip.shape[1], c0 + strip.shape[2]
+        if r0 < 0 or c0 < 0 or r1 > self.canvas.shape[1] or c1 > self.canvas.shape[2]:
+            raise ValueError("Strip does not fit in the mosaic canvas")
+
+        self._write(strip, r0, c0)
+
+        self.last = (r0, r1, c0, c1)
+        self.placements.append([r0, c0])
+        self.canvas.attrs["placements"] = self.placements
+
+        return r0, c0
+
+    def _weights(self, c0: int, c1: int) -> ndarray:
+        # feathering ramp across the middle of the overlap with the last strip
+        pc1 = self.last[3]
+        center = (c0 + pc1) / 2
+        width = min(self.blend_width, pc1 - c0)
+        cols = np.arange(c0, c1) + 0.5
+        return np.clip((cols - center) / width + 0.5, 0, 1).astype(np.float32)
+
+    def _write(self, strip: ndarray, r0: int, c0: int):
+        r1, c1 = r0 + strip.shape[1], c0 + strip.shape[2]
+
+        blend = self.last is not None and self.last[3] > c0
+        if blend:
+            pr0, pr1 = self.last[:2]
+            weights = self._weights(c0, c1)
+            # columns that take some of the canvas values
+            cb = c0 + int(np.count_nonzero(weights < 1))
+
+        # row blocks aligned with the canvas chunks
+        step = self.canvas.chunks[1]
+        for p in range(strip.shape[0]):
+            for a in range(r0 - r0 % step, r1, step):
+                ra, rb = max(a, r0), min(a + step, r1)
+                block = np.asarray(strip[p, ra - r0 : rb - r0])
+
+                # rows next to the previous strip
+                sa, sb = (max(ra, pr0), min(rb, pr1)) if blend else (0, 0)
+                if sb > sa and cb > c0:
+                    block = block.astype(np.float32)
+                    old = self.canvas[p, sa:sb, c0:cb].astype(np.float32)
+
+                    w = weights[: cb - c0]
+                    seam = block[sa - ra : sb - ra, : cb - c0]
+                    seam *= w
+                    seam += old * (1 - w)
+
+                    block = np.rint(block).astype(np.uint16)
+
+                self.canvas[p, ra:rb, c0:c1] = block
+
+
+def stitch_rows(
+    fnames: list,
+    out_fname: str,
+    level: int = 0,
+    max_shift: tuple = (50, 20),
+    **kwargs,
+) -> zarr.Array:
+    """Stitch the row reconstructions of a raster scan into one mosaic
+
+    Strips are placed by the row plan stored with each reconstruction. If
+    the encoder positions of a row were saved next to it (<name>_positions.npy)
+    they give the position along the scan instead of the planned start.
+    Pyramid level > 0 stitches a downsampled preview. Further keyword
+    arguments are passed to Mosaic
+    """
+    scale = 2**level
+    strips = []
+
+    for fname in fnames:
+        params = export.read_params(fname)
+        strip = export.open_reconstruction(fname, level)
+        pixel_size = params["pixel_size_mm"] * scale
+
+        x_mm = None
+        positions_fname = fname.replace(".ome.tif", "_positions.npy")
+        if os.path.exists(positions_fname):
+            positions = np.load(positions_fname)
+            if params.get("reverse"):
+                positions = positions[::-1]
+            x_mm = strip_origin(positions[::scale], pixel_size)
+
+        if x_mm is None:
+            x_mm = min(params["start"], params["stop"])
+
+        # rows of the cropped planes start height_max frames in
+        x_mm += params["sensor_height_max"] * params["pixel_size_mm"]
+        y_mm = params["y"] - strip.shape[2] * pixel_size / 2
+
+        strips.append((y_mm, x_mm, strip))
+
+    strips.sort(key=lambda s: s[0])
+    pixel_size = params["pixel_size_mm"] * scale
+
+    # canvas covers all nominal positions plus the registration range
+    margin = np.array(max_shift) * pixel_size
+    x_min = min(s[1] for s in strips) - margin[0]
+    y_min = min(s[0] for s in strips) - margin[1]
+    height = max(s[1] + s[2].shape[1] * pixel_size for s in strips) + margin[0]
+    width = max(s[0] + s[2].shape[2] * pixel_size for s in strips) + margin[1]
+
+    shape = (
+        strips[0][2].shape[0],
+        int(np.ceil((height - x_min) / pixel_size)) + 1,
+        int(np.ceil((width - y_min) / pixel_size)) + 1,
+    )
+
+    mosaic = Mosaic(
+        out_fname,
+        shape,
+        pixel_size,
+        origin_mm=(x_min, y_min),
+        max_shift=max_shift,
+        **kwargs,
+    )
+
+    for y_mm, x_mm, strip in strips:
+        r, c = mosaic.add(strip, x_mm, y_mm)
+        print(f"Placed strip at y = {y_mm:.3f} mm in canvas ({r}, {c})")
+
+    return mosaic.canvas
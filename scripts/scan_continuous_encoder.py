@@ -4,16 +4,22 @@
 
 import os
 import json
-import napari
 import warnings
+import napari
+import numpy as np
 import processing.alignment as alignment
 import processing.artifacts as artifacts
+import processing.export as export
 
 from pypylon import pylon
 from datetime import datetime
+from concurrent.futures import Future
 from ni.daq import DAQ
 from asi.asistage import MS2000
+from asi.telemetry import TelemetrySampler
+from autofocus import ensure_focus
 from basler.baslerace import ACA2040
+from basler.streaming import read_stream
 
 
 def create_data_dir():
@@ -24,6 +30,20 @@ def create_data_dir():
     return (path, dirname)
 
 
+def write_params(fname: str, params: dict):
+    with open(fname, "w") as file:
+        file.write(json.dumps(params, indent=4))
+
+
+def move_to_row(stage: object, mid_point: tuple) -> Future:
+    # first move to mid-point y-value
+    stage.set_speed(x=1, y=1)
+    stage.move_axis("Y", mid_point[1])
+
+    # motors settle in the background while the camera is configured
+    return stage.wait_for_device_async(timeout=30)
+
+
 def scan(
     stage: object,
     vel: float,
@@ -32,23 +52,20 @@ def scan(
     fov_height: float,
     enc_divide: float,
     num_pix: int,
-):
-    # first move to mid-point y-value
-    stage.set_speed(x=1, y=1)
-    stage.move_axis("Y", mid_point[1])
-
-    # wait for motors to reach position
-    stage.wait_for_device()
-
+) -> float:
     stage.set_speed(x=vel, y=vel)
 
     # invert TTL logic
     stage.ttl("F", -1)
 
     start = mid_point[0] - scan_range / 2 - fov_height / 2
-    start = "{:.6f}".format(start)
 
-    stage.scan_x_axis_enc(start=start, num_pix=num_pix, enc_divide=enc_divide)
+    stage.scan_x_axis_enc(
+        start="{:.6f}".format(start), num_pix=num_pix, enc_divide=enc_divide
+    )
+
+    # x-position of the first encoder pulse in mm
+    return start
 
 
 if __name__ == "__main__":
@@ -61,20 +78,28 @@ if __name__ == "__main__":
     # give illuminator time to warm up
     # cam.illuminator(True)
 
-    # query CRISP state
-    if stage.get_crisp_state() != "F":
-        warnings.warn("CRISP may not be locked!")
-        # stage.lock_crisp()
+    # lock CRISP, or focus on the image before the zones are configured
+    ensure_focus(stage, cam)
 
     mid_point = (0, 0)  # scan mid-point
     num_zones = 5  # number of image slices
     scan_range_factor = 4  # number of overlapping fovs
+    stream = False  # write rows to disk as they arrive
+    zone_mode = "single"  # use all zone rows: "tdi" (average) or "lines" (faster scan)
+    log_encoder = True  # record frame exposures per encoder tick with the DAQ
+    log_telemetry = True  # sample stage position and CRISP state during the scan
 
     scan_range = scan_range_factor * cam.fov_height_mm
     total_row_acq = cam.sensor_height_pix * (scan_range_factor + 1)
 
+    # in "lines" mode the stage advances a full zone height per frame
+    rows_per_frame = cam.rows_per_frame(zone_mode)
+    total_frames = -(-total_row_acq // rows_per_frame)
+
     # restrict stage velocity to 4 decimal places
-    stage_vel = "{:.4f}".format(cam.sensor_pix_size_mm * cam.fps_max)
+    stage_vel = "{:.4f}".format(cam.sensor_pix_size_mm * cam.fps_max * rows_per_frame)
+
+    settled = move_to_row(stage, mid_point)
 
     # configure camera triggers, zones, and IO
     cam.set_trigger(source="Line4")
@@ -82,42 +107,96 @@ if __name__ == "__main__":
     cam.set_roi_zones(num_zones)
 
     # initialize DAQ
-    # daq = DAQ(total_row_acq)
+    if log_encoder:
+        daq = DAQ(total_frames)
+
+    # parameters are on disk before the scan, in case it is interrupted
+    params = {
+        "total_reconstructions": num_zones,
+        "total_overlap_fovs": scan_range_factor,
+        "scan_midpoint": mid_point,
+        "scan_range": scan_range,
+        "scan_velocity_mm_s": stage_vel,
+        "zone_mode": zone_mode,
+        "skipped_frames": None,
+        "zone_offsets": (
+            None if cam.zone_offsets is None else cam.zone_offsets.tolist()
+        ),
+        "sensor_height_max": cam.height_max,
+        "exposure_time_us": cam.exposure_time_us,
+        "pixel_size_mm": cam.sensor_pix_size_mm,
+    }
+    params_fname = os.path.join(path, dirname + "_params.json")
+    write_params(params_fname, params)
+
+    # wait for motors to reach position
+    settled.result()
+
+    # count exposures from the first encoder pulse on
+    if log_encoder:
+        daq.start()
+
+    if log_telemetry:
+        telemetry = TelemetrySampler(stage, rate=20)
+        telemetry.start()
 
     # initiate scan and data acquisition
-    scan(
+    scan_start = scan(
         stage,
         stage_vel,
         mid_point,
         scan_range,
         cam.fov_height_mm,
-        cam.sensor_pix_size_mm * 1e5,
-        total_row_acq,
+        cam.sensor_pix_size_mm * 1e5 * rows_per_frame,
+        total_frames,
     )
-    # daq.start()
-    img = cam.acquire_stack(num_zones, total_row_acq, timeout=5000)
-    # daq.plot_data()
-    # daq.stop()
+    if stream:
+        fname = os.path.join(path, dirname + "_stream.npy")
+        cam.stream_stack(
+            fname, num_zones, total_row_acq, timeout=5000, zone_mode=zone_mode
+        )
+        img = read_stream(fname)
+    else:
+        img = cam.acquire_stack(
+            num_zones, total_row_acq, timeout=5000, zone_mode=zone_mode
+        )
+
+    if log_encoder:
+        if not daq.wait(timeout=1):
+            warnings.warn(
+                f"Encoder recorded {daq.head} of {daq.total_ticks} ticks, "
+                "frame positions past the last tick are unknown"
+            )
+        daq.stop()
+        print(f"Encoder counters: {daq.stats}")
+
+        params["skipped_frames"] = daq.stats.skipped
+        write_params(params_fname, params)
+
+        # true stage position of every recorded frame
+        frame_positions = daq.frame_positions(
+            cam.frame_ids, scan_start, cam.sensor_pix_size_mm * rows_per_frame
+        )
+        np.save(os.path.join(path, dirname + "_positions.npy"), frame_positions)
+
+    if log_telemetry:
+        telemetry.stop()
+        telemetry.save(os.path.join(path, dirname + "_telemetry.npz"))
 
     img = cam.crop_overlap_zone(img)
 
+    # filter_col_artifacts returns a corrected copy, None without filter values
     img_proc = artifacts.filter_col_artifacts(img)
-    img_proc = alignment.align(img_proc)
-    img_proc = alignment.align(img)
+    img_proc = alignment.align(img if img_proc is None else img_proc)
 
-    params = {
-        "total_reconstructions": num_zones,
-        "total_overlap_fovs": scan_range_factor,
-        "scan_midpoint": mid_point,
-        "scan_range": scan_range,
-        "scan_velocity_mm_s": stage_vel,
-        "exposure_time_us": cam.exposure_time_us,
-        "pixel_size_mm": cam.sensor_pix_size_mm,
-    }
-
-    fname = os.path.join(path, dirname + "_params.json")
-    with open(fname, "w") as file:
-        file.write(json.dumps(params, indent=4))
+    # save imaging data with embedded acquisition parameters
+    for name, arr in (("raw", img), ("proc", img_proc)):
+        export.write_reconstruction(
+            os.path.join(path, f"{dirname}_{name}.ome.tif"),
+            arr,
+            params=params,
+            pixel_size_mm=cam.sensor_pix_size_mm,
+        )
 
     viewer = napari.Viewer()
 
@@ -127,13 +206,6 @@ if __name__ == "__main__":
 
     napari.run()
 
-    img_raw = cam.format_image_array(img)
-    img_proc = cam.format_image_array(img_proc)
-
-    # save imaging data
-    cam.save_image_array(img_raw, os.path.join(path, dirname + "_raw.tif"))
-    cam.save_image_array(img_proc, os.path.join(path, dirname + "_proc.tif"))
-
     # cam.illuminator(False)
 
     # housekeeping
@@ -0,0 +1,226 @@
+# ===============================================================================
+#    Serpentine raster scan of a rectangular area in overlapping rows
+# ===============================================================================
+
+import os
+import json
+import math
+import processing.alignment as alignment
+import processing.artifacts as artifacts
+import processing.export as export
+import processing.stitching as stitching
+
+from numpy import ndarray
+from concurrent.futures import Future, ThreadPoolExecutor
+from asi.asistage import MS2000
+from asi.telemetry import TelemetrySampler
+from autofocus import ensure_focus
+from basler.baslerace import ACA2040
+from datetime import datetime
+
+
+def create_data_dir():
+    now = datetime.now()
+    dirname = now.strftime("%Y-%m-%d_%H-%M-%S")
+    path = os.path.join("C:\\Users\\lukas\\Data", dirname)
+    os.mkdir(path)
+    return (path, dirname)
+
+
+def plan_raster(
+    x_range: tuple,
+    y_range: tuple,
+    fov_width: float,
+    fov_height: float,
+    pix_size: float,
+    overlap: float = 0.1,
+    serpentine: bool = True,
+) -> list:
+    """Plan the rows of a raster scan covering a rectangle (in mm)
+
+    Rows run along x and are fov_width apart less the overlap fraction,
+    centered on the rectangle. With serpentine, every other row is
+    scanned backwards so the stage never returns to the start edge.
+
+    Returns one dict per row with its y-position, scan direction and the
+    arguments of MS2000.scan_x_axis_enc
+    """
+    x_min, x_max = sorted(x_range)
+    y_min, y_max = sorted(y_range)
+
+    step = fov_width * (1 - overlap)
+    num_rows = max(math.ceil((y_max - y_min - fov_width) / step), 0) + 1
+    y_first = (y_min + y_max) / 2 - (num_rows - 1) * step / 2
+
+    # all zones see the area after half a FOV on either side
+    start = x_min - fov_height / 2
+    stop = x_max + fov_height / 2
+    num_pix = math.ceil((stop - start) / pix_size)
+
+    rows = []
+    for i in range(num_rows):
+        reverse = serpentine and i % 2 == 1
+        rows.append(
+            {
+                "row": i,
+                "y": y_first + i * step,
+                "reverse": reverse,
+                "start": stop if reverse else start,
+                "stop": start if reverse else stop,
+                "num_pix": num_pix,
+            }
+        )
+
+    return rows
+
+
+def step_to_row(stage: object, y: float) -> Future:
+    """Move to the y-position (mm) of a row, settling in the background"""
+    stage.set_speed(x=1, y=1)
+    stage.move_axis("Y", round(y * 1e4))
+    return stage.wait_for_device_async(timeout=30)
+
+
+def scan_row(stage: object, row: dict, vel: str, enc_divide: float):
+    stage.set_speed(x=vel, y=vel)
+
+    # invert TTL logic
+    stage.ttl("F", -1)
+
+    stage.scan_x_axis_enc(
+        start="{:.6f}".format(row["start"]),
+        stop="{:.6f}".format(row["stop"]),
+        num_pix=row["num_pix"],
+        enc_divide=enc_divide,
+    )
+
+
+def process_row(
+    img: ndarray, row: dict, offsets: ndarray, height_max: int, fname: str, params: dict
+):
+    """Crop, correct and save the reconstruction of one row"""
+    if row["reverse"]:
+        # return rows record the area back to front
+        img = img[:, ::-1]
+
+    img = ACA2040.crop_overlap(img, offsets, height_max)
+
+    img_proc = artifacts.filter_col_artifacts(img)
+    img_proc = alignment.align(img if img_proc is None else img_proc)
+
+    export.write_reconstruction(
+        fname,
+        img_proc,
+        params={**params, **row},
+        pixel_size_mm=params["pixel_size_mm"],
+    )
+
+
+if __name__ == "__main__":
+    path, dirname = create_data_dir()
+
+    # initialize devices
+    cam = ACA2040(exposure_time_us=50, sensor_pixel_size_mm=360e-6)
+    stage = MS2000("COM3", 115200)
+
+    # lock CRISP, or focus on the image before the zones are configured
+    ensure_focus(stage, cam)
+
+    x_range = (-5, 5)  # scan area in mm
+    y_range = (-5, 5)
+    num_zones = 5  # number of image slices
+    overlap = 0.1  # fraction of the FOV width shared by neighbouring rows
+
+    fov_width = cam.frame_width_pix * cam.sensor_pix_size_mm
+
+    plan = plan_raster(
+        x_range,
+        y_range,
+        fov_width,
+        cam.fov_height_mm,
+        cam.sensor_pix_size_mm,
+        overlap,
+    )
+
+    # restrict stage velocity to 4 decimal places
+    stage_vel = "{:.4f}".format(cam.sensor_pix_size_mm * cam.fps_max)
+    enc_divide = cam.sensor_pix_size_mm * 1e5
+
+    print(f"Scanning {len(plan)} rows of {plan[0]['num_pix']} frames")
+
+    settled = step_to_row(stage, plan[0]["y"])
+
+    # configure camera triggers, zones, and IO
+    cam.set_trigger(source="Line4")
+    cam.set_io_control(line=2, source="ExposureActive")
+    cam.set_roi_zones(num_zones)
+
+    params = {
+        "total_reconstructions": num_zones,
+        "scan_area_mm": [x_range, y_range],
+        "row_overlap": overlap,
+        "scan_velocity_mm_s": stage_vel,
+        "exposure_time_us": cam.exposure_time_us,
+        "pixel_size_mm": cam.sensor_pix_size_mm,
+        "zone_offsets": (
+            None if cam.zone_offsets is None else cam.zone_offsets.tolist()
+        ),
+        "sensor_height_max": cam.height_max,
+    }
+
+    with open(os.path.join(path, dirname + "_plan.json"), "w") as file:
+        file.write(json.dumps({"params": params, "rows": plan}, indent=4))
+
+    # position and CRISP state over the whole scan, e.g. for focus drift
+    telemetry = TelemetrySampler(stage, rate=10)
+    telemetry.start()
+
+    # frames of a row are drained on one thread and earlier rows processed
+    # on another, while this thread moves on to the next row
+    with ThreadPoolExecutor(max_workers=1) as grab, ThreadPoolExecutor(
+        max_workers=1
+    ) as proc:
+        processed = []
+        fnames = []
+
+        for i, row in enumerate(plan):
+            settled.result()
+
+            acquired = grab.submit(cam.acquire_stack, num_zones, row["num_pix"])
+            scan_row(stage, row, stage_vel, enc_divide)
+
+            # the last encoder pulse is out once the scan ends, so the y-step
+            # overlaps with draining the remaining frames
+            stage.wait_for_device()
+            if i + 1 < len(plan):
+                settled = step_to_row(stage, plan[i + 1]["y"])
+
+            fname = os.path.join(path, f"{dirname}_row{i:03d}.ome.tif")
+            fnames.append(fname)
+            processed.append(
+                proc.submit(
+                    process_row,
+                    acquired.result(),
+                    row,
+                    cam.zone_offsets,
+                    cam.height_max,
+                    fname,
+                    params,
+                )
+            )
+
+        for future in processed:
+            future.result()
+
+    telemetry.stop()
+    telemetry.save(os.path.join(path, dirname + "_telemetry.npz"))
+
+    # combine the rows into one mosaic
+    stitching.stitch_rows(fnames, os.path.join(path, dirname + "_mosaic.zarr"))
+
+    # housekeeping
+    print("Safely closing serial ports...")
+    stage.close()
+    print("ASI stage connection closed")
+    cam.close()
+    print("Basler camera connection closed")
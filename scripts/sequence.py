@@ -5,21 +5,14 @@
 #    Stage moves to the next position in ring buffer at TTL signal
 # ===============================================================================
 
-import math
-import platform
-
-from pypylon import pylon
-from pypylon import genicam
+from numpy import ndarray
 from asi.asistage import MS2000
+from basler.baslerace import ACA2040
 
 
-def config_stage(stage: object, zstack_range_um: int, num_zslices: int):
-    # reset piezo axis
-    stage.move_axis("F", 0)
-
+def config_stage(stage: object):
     # query ring buffer configuration
-    stage.send_command("RM Y?")
-    buf_config = stage.read_response()
+    buf_config = stage.query("RM Y?")
 
     # buffer config must read Y=15
     if "Y=15" not in buf_config:
@@ -29,94 +22,110 @@ def config_stage(stage: object, zstack_range_um: int, num_zslices: int):
         stage.save_settings()
 
     # check ring buffer mode (F=1 => standard TTL trigger mode)
-    stage.send_command("RM F?")
-    buf_mode = stage.read_response()
+    buf_mode = stage.query("RM F?")
 
-    if "F=1" not in buf_mode:
-        stage.send_command("RM F=1")
+    with stage.batch() as batch:
+        if "F=1" not in buf_mode:
+            batch.add("RM F=1")
 
-    # clear the ring buffer
-    stage.send_command("RM X=0")
+        # set TTL
+        batch.add("TTL X=1")
 
-    # ASI units are 1/10 um
-    stop = math.trunc(zstack_range_um / 10 / 2)
-    start = -1 * stop
-    step = math.trunc(zstack_range_um / num_zslices)
 
-    # load the buffer
-    for val in range(start, stop, step):
-        # for linear z, negative values move closer to sample
-        command = f"LD F={-1*val}"
-        stage.send_command(command)
-        # stage.read_response()
+def z_positions(zstack_range_um: float, num_zslices: int) -> list:
+    """Return evenly spaced piezo positions centered on zero
 
-    # set TTL
-    stage.send_command("TTL X=1")
+    ASI units are 1/10 um, for linear z negative values move closer to
+    sample
+    """
+    start = -zstack_range_um * 10 / 2
+    step = zstack_range_um * 10 / max(num_zslices - 1, 1)
+    return [-round(start + i * step) for i in range(num_zslices)]
 
 
-def config_camera():
-    try:
-        camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
-        camera.Open()
+def plan_segments(positions: list, size: int = MS2000.BUFFER_SIZE) -> list:
+    """Split positions into segments that fit into the ring buffer
+
+    The stage moves to the next ring buffer entry after each exposure, so
+    the entries of a segment are the positions of its following exposures.
+    The last entry is the first position of the next segment
+    """
+    return [
+        {
+            "positions": positions[i : i + size],
+            "entries": positions[i + 1 : i + size + 1],
+        }
+        for i in range(0, len(positions), size)
+    ]
+
+
+def load_segment(stage: object, segment: dict):
+    """Replace the ring buffer with the entries of a segment and verify it
+
+    The buffer is cleared, loaded, and its entry count read back in a
+    single round-trip. Every reply is checked, an out of range position
+    raises ASIError
+    """
+    with stage.batch() as batch:
+        # clear the ring buffer, also rewinds it to the first entry
+        batch.add("RM X=0")
+
+        for val in segment["entries"]:
+            batch.add(f"LD F={val}")
+
+        count = batch.add("RM X?")
+
+    if f"X={len(segment['entries'])}" not in batch.responses[count]:
+        raise RuntimeError(
+            f"Ring buffer holds {batch.responses[count]!r}, "
+            f"expected {len(segment['entries'])} entries"
+        )
+
 
-        # configure output signal on dedicated opto-isolated output line
-        camera.LineSelector.SetValue("Line2")
-        camera.LineSource.SetValue("ExposureActive")
-        camera.LineMinimumOutputPulseWidth.SetValue(100.0)  # signal pulse width [us]
+def config_camera(pix_format: str = "Mono12") -> ACA2040:
+    cam = ACA2040(pix_format=pix_format)
 
-        return camera
-    except genicam.GenericException:
-        raise
+    # configure output signal on dedicated opto-isolated output line
+    cam.set_io_control(line=2, source="ExposureActive", pulse_width=100.0)
 
+    return cam
+
+
+def sequence(
+    stage: object,
+    cam: ACA2040,
+    positions: list,
+    fname: str = "zstack.tif",
+    segment_size: int = MS2000.BUFFER_SIZE,
+) -> ndarray:
+    """Acquire a z-stack and write it to a single multi-page TIFF
+
+    Every exposure advances the stage to the next ring buffer position.
+    Stacks longer than the ring buffer are acquired in segments: the
+    camera pauses after each one while the buffer is reloaded and the stage
+    moves to the first position of the next segment, and frames of the
+    finished segment are written in the meantime
+    """
+    segments = plan_segments(positions, segment_size)
+
+    def before_segment(k: int):
+        load_segment(stage, segments[k])
+
+        # first exposure is taken at the current position, and an extra
+        # exposure before the camera stopped may have advanced the stage
+        stage.move_axis("F", segments[k]["positions"][0])
+        stage.wait_for_device()
 
-def sequence(camera: object, num_zslices: int = 20):
     try:
-        # create image window
-        # image_window = pylon.PylonImageWindow()
-        # image_window.Create(1)
-
-        # create image instance to store data
-        img = pylon.PylonImage()
-        tlf = pylon.TlFactory.GetInstance()
-
-        camera.StartGrabbingMax(num_zslices, pylon.GrabStrategy_LatestImageOnly)
-
-        img_counter = 0
-
-        while camera.IsGrabbing():
-            # set timeout to 5000 ms
-            grabResult = camera.RetrieveResult(
-                5000, pylon.TimeoutHandling_ThrowException
-            )
-
-            if grabResult.GrabSucceeded():
-                # image_window.SetImage(grabResult)
-                # image_window.Show()
-                img.AttachGrabResultBuffer(grabResult)
-
-                filename = f"img_{img_counter}"
-
-                # save image to file
-                if platform.system() == "Windows":
-                    ipo = pylon.ImagePersistenceOptions()
-                    quality = 90
-                    ipo.SetQuality(quality)
-                    img.Save(pylon.ImageFileFormat_Jpeg, filename, ipo)
-                else:
-                    img.Save(pylon.ImageFileFormat_Png, filename)
-
-                img_counter += 1
-            else:
-                print(grabResult.ErrorCode)
-
-            grabResult.Release()
-            img.Release()
-    except genicam.GenericException:
-        raise
+        return cam.acquire_zstack(
+            len(positions),
+            fname,
+            description={"positions": positions},
+            segment_size=segment_size,
+            before_segment=before_segment,
+        )
     finally:
-        stage.send_command("TTL X=0")
-        stage.close()
-        camera.Close()
+        stage.ttl("X", 0)
         print("FINISHED!")
 
 
@@ -124,8 +133,14 @@ if __name__ == "__main__":
     # create MS-2000 serial interface
     stage = MS2000("COM3", 115200)
 
-    config_stage(stage, zstack_range_um=1000, num_zslices=10)
+    config_stage(stage)
+
+    cam = config_camera()
 
-    camera = config_camera()
+    positions = z_positions(zstack_range_um=1000, num_zslices=200)
 
-    sequence(camera, 10)
+    try:
+        sequence(stage, cam, positions)
+    finally:
+        stage.close()
+        cam.close()
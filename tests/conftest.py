@@ -0,0 +1,7 @@
+import os
+import sys
+
+# modules are imported relative to scripts/, the way the scripts run
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts")
+)
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+
+from asi.asistage import ASIError
+from asi.asistage_async import AsyncMS2000
+from asi.emulator import MS2000Emulator
+
+
+@pytest.fixture
+def emulator():
+    emulator = MS2000Emulator(latency=0, crisp_state="R")
+    emulator.port = emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+def test_lost_reply_does_not_shift_later_replies(emulator):
+    async def run():
+        async with AsyncMS2000(emulator.port) as stage:
+            emulator.drop_replies = 1
+            with pytest.raises(ASIError):
+                await stage.query("WHERE X", timeout=0.3)
+
+            assert await stage.query("LK X?") == ":A R"
+            assert await stage.get_crisp_state() == "R"
+
+            emulator.drop_replies = 1
+            with pytest.raises(ASIError):
+                await stage.query_many(["WHERE X", "LK X?", "/"], timeout=0.3)
+
+            assert await stage.query_many(["LK X?", "/"]) == [":A R", "N"]
+
+    asyncio.run(run())
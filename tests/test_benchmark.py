@@ -0,0 +1,15 @@
+import pytest
+import benchmark
+import processing.calibration as calibration
+
+
+@pytest.mark.parametrize("num_planes, total_rows", benchmark.SIZES)
+def test_run_benchmarks(num_planes, total_rows):
+    store = calibration.store
+
+    # a fraction of the configured rows, at a narrow width
+    results = benchmark.run_benchmarks(num_planes, total_rows // 20, 128, repeats=1)
+
+    assert "align" in results and "write_reconstruction" in results
+    assert all(result["best_s"] >= 0 for result in results.values())
+    assert calibration.store is store
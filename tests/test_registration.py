@@ -0,0 +1,54 @@
+import numpy as np
+
+from scipy import ndimage
+from processing.registration import row_shift, shift_error
+
+
+def noisy_pair(shift: int, height: int = 400, width: int = 300, seed: int = 1):
+    """Return two noisy views of a smooth scene offset by shift rows"""
+    rng = np.random.default_rng(seed)
+    scene = ndimage.uniform_filter(rng.random((height + shift, width)), 5) * 1000
+
+    ref = scene[shift : shift + height] + rng.normal(0, 20, (height, width))
+    mov = scene[:height] + rng.normal(0, 20, (height, width))
+    return ref, mov
+
+
+def test_shift_error_full_frame_search():
+    ref, mov = noisy_pair(7)
+
+    lags, errors = shift_error(ref, mov, axis=0, max_shift=None, normalize=True)
+
+    assert lags[0] == -399 and lags[-1] == 399
+    assert lags[np.argmin(errors)] == 7
+
+
+def test_shift_error_window_does_not_change_the_minimum():
+    ref, mov = noisy_pair(7)
+
+    for max_shift in (20, 200, None):
+        lags, errors = shift_error(
+            ref, mov, axis=0, max_shift=max_shift, normalize=True
+        )
+        assert lags[np.argmin(errors)] == 7
+
+
+def brute_force_errors(ref: np.ndarray, mov: np.ndarray, max_shift: int) -> dict:
+    """Raw error of every lag as computed by the previous per-lag search"""
+    errors = {0: np.sqrt(np.sum(np.square(ref - mov)))}
+    for r in range(1, max_shift):
+        errors[r] = np.sqrt(np.sum(np.square(ref[:-r] - mov[r:])))
+        errors[-r] = np.sqrt(np.sum(np.square(ref[r:] - mov[:-r])))
+    return errors
+
+
+def test_row_shift_matches_brute_force_near_the_window_edge():
+    for shift in (17, 18, 19):
+        ref, mov = noisy_pair(shift, seed=shift)
+        expected = brute_force_errors(ref, mov, 20)
+
+        lags, errors = shift_error(ref, mov, axis=0, max_shift=20)
+        np.testing.assert_allclose(errors, [expected[lag] for lag in lags])
+
+        rows = row_shift(np.stack([ref, mov]), max_shift=20)
+        assert rows[0] == -min(expected, key=expected.get) == -shift
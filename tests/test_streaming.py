@@ -0,0 +1,68 @@
+import threading
+import numpy as np
+import pytest
+
+from basler.streaming import RowWriter, StackWriter
+
+
+class FullDisk:
+    """Stands in for the memory-mapped array of a disk that is full"""
+
+    def __init__(self, shape: tuple):
+        self.shape = shape
+
+    def __setitem__(self, index, value):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+
+def call_with_timeout(func, timeout: float = 10.0):
+    """Run func on a thread, return the exception it raised"""
+    result = {}
+
+    def run():
+        try:
+            func()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "call blocked"
+    return result.get("error")
+
+
+def test_row_writer_raises_write_failure(tmp_path):
+    writer = RowWriter(str(tmp_path / "stack.npy"), 3, 1024, 16, max_queue=2)
+    writer.arr = FullDisk(writer.arr.shape)
+    writer.start()
+
+    block = np.ones((3, 8, 16), dtype=np.uint16)
+
+    def put_all():
+        for start in range(0, 1024, 8):
+            writer.put(start, block)
+
+    error = call_with_timeout(put_all)
+    assert isinstance(error, RuntimeError)
+    assert isinstance(error.__cause__, OSError)
+
+    # the queue may be full, closing must not wait on it
+    assert call_with_timeout(writer.close) is None
+    with pytest.raises(RuntimeError):
+        writer.check()
+
+
+def test_stack_writer_raises_write_failure(tmp_path):
+    stack = np.zeros((4, 8, 8), dtype=np.uint16)
+    writer = StackWriter(str(tmp_path / "missing" / "stack.tif"), stack)
+    writer.start()
+    writer.join()
+
+    with pytest.raises(RuntimeError):
+        writer.put(0)
+
+    assert call_with_timeout(writer.close) is None